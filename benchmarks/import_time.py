@@ -0,0 +1,42 @@
+''' Measures the time taken to import huawei_lte.router in a fresh interpreter
+
+python benchmarks/import_time.py [runs]
+'''
+import os
+import subprocess
+import sys
+import statistics
+
+HEAVY_MODULES = ['requests', 'urllib3', 'Crypto', 'IPy', 'huawei_lte.crypto']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import huawei_lte.router
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(m for m in %r if m in sys.modules))
+''' % HEAVY_MODULES
+
+def run_once():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=root, universal_newlines=True)
+    elapsed, loaded = output.splitlines()[:2]
+    return float(elapsed), [m for m in loaded.split(',') if m]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    #First run compiles the byte code
+    run_once()
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        elapsed, loaded = run_once()
+        timings.append(elapsed * 1000)
+    print('import huawei_lte.router over %i runs' % runs)
+    print('  median: %.1f ms' % statistics.median(timings))
+    print('  min:    %.1f ms' % min(timings))
+    print('  heavy modules loaded: %s' % (', '.join(loaded) if loaded else 'none'))
+
+if __name__ == '__main__':
+    main()
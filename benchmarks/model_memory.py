@@ -0,0 +1,54 @@
+''' Compares the memory used by parsed XmlModel records with the same records held in a __dict__
+
+python benchmarks/model_memory.py [count]
+'''
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import huawei_lte.xmlobjects as xmlobjects
+
+class DictObject(xmlobjects.XmlObject):
+    '''The layout every XmlObject had before XmlModel: fields and skip flags in a per instance __dict__'''
+    def __init__(self, template, xml):
+        super(DictObject, self).__init__({})
+        for prop in template.getPropertyNames():
+            setattr(self, prop, template.getValue(prop))
+        self.parseXML(xml)
+
+def static_host(i):
+    return '<Host><HostIndex>%i</HostIndex><HostHw>92:1b:46:9d:%02x:%02x</HostHw><HostIp>192.168.%i.%i</HostIp><HostEnabled>1</HostEnabled></Host>' % (
+        i, i // 256 % 256, i % 256, i // 256 % 256, i % 256)
+
+def virtual_server(i):
+    return ('<Server><VirtualServerIPName>svc%i</VirtualServerIPName><VirtualServerStatus>1</VirtualServerStatus>'
+            '<VirtualServerRemoteIP></VirtualServerRemoteIP><VirtualServerWanPort>%i</VirtualServerWanPort>'
+            '<VirtualServerWanEndPort>%i</VirtualServerWanEndPort><VirtualServerLanPort>%i</VirtualServerLanPort>'
+            '<VirtualServerLanEndPort>%i</VirtualServerLanEndPort><VirtualServerIPAddress>192.168.8.%i</VirtualServerIPAddress>'
+            '<VirtualServerProtocol>6</VirtualServerProtocol></Server>') % (i, i, i, i, i, i % 256)
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return records, used
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print('%i parsed records' % count)
+    print('%-14s %12s %12s %8s' % ('', 'dict (KiB)', 'slots (KiB)', 'saving'))
+    for cls, make in [(xmlobjects.StaticHost, static_host), (xmlobjects.VirtualServer, virtual_server)]:
+        xml = [make(i) for i in range(count)]
+        template = cls(xml[0])
+        dicts, dict_size = measure(lambda: [DictObject(template, x) for x in xml])
+        models, slots_size = measure(lambda: [cls(x) for x in xml])
+        #The XML contract is unchanged
+        assert all(m.buildXML(False) == d.buildXML(False) for m, d in zip(models, dicts))
+        print('%-14s %12.0f %12.0f %7.0f%%' % (
+            cls.__name__, dict_size / 1024.0, slots_size / 1024.0, 100 - 100.0 * slots_size / dict_size))
+
+if __name__ == '__main__':
+    main()
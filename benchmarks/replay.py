@@ -0,0 +1,48 @@
+''' Times the API's handling of recorded router responses, without a router
+
+python benchmarks/replay.py cassette [repeat]
+
+Record a cassette from a router with
+    router = lte.B525Router('192.168.8.1', transport=RecordingTransport('b525.jsonl.gz'))
+    router.login(...) then read the endpoints to benchmark, and router.transport.close()
+'''
+import os
+import sys
+import gzip
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import huawei_lte.router as lte
+import huawei_lte.instrument as instrument
+from huawei_lte.transport import ReplayTransport
+
+def recorded_urls(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as cassette:
+        exchanges = [json.loads(line) for line in cassette if line.strip()]
+    urls = []
+    for exchange in exchanges:
+        url = exchange['path'][len('/api/'):]
+        if exchange['method'] == 'GET' and exchange['path'].startswith('/api/') and url != 'webserver/token' and url not in urls:
+            urls.append(url)
+    return urls
+
+def main():
+    path = sys.argv[1]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    router = lte.B525Router('replay', transport=ReplayTransport(path))
+    router.login('admin', 'replay')
+    urls = recorded_urls(path)
+    collector = instrument.HistogramCollector()
+    instrument.add(collector)
+    for _ in range(repeat):
+        for url in urls:
+            router.api(url)
+    instrument.remove(collector)
+    print('%-28s %8s %10s %10s %10s' % ('', 'count', 'mean (us)', 'p95 (us)', 'max (us)'))
+    for name, stats in sorted(collector.summary().items()):
+        print('%-28s %8i %10.0f %10.0f %10.0f' % (
+            name, stats['count'], stats['mean'] * 1e6, stats['p95'] * 1e6, stats['max'] * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+''' Measures crypto.rsa_encrypt for a range of payload sizes, with and without the cached cipher
+
+python benchmarks/rsa_encrypt.py [repeats]
+'''
+import os
+import sys
+import timeit
+
+from Crypto.PublicKey import RSA
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import huawei_lte.crypto as crypto
+
+SIZES = [100, 1000, 10000, 100000]
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    key = RSA.generate(2048)
+    rsae = '%x' % key.e
+    rsan = '%x' % key.n
+
+    def cold():
+        crypto._rsa_cipher.cache_clear()
+        crypto.rsa_encrypt(rsae, rsan, payload)
+
+    def warm():
+        crypto.rsa_encrypt(rsae, rsan, payload)
+
+    print('%10s %12s %12s' % ('bytes', 'cold (ms)', 'cached (ms)'))
+    for size in SIZES:
+        payload = '<request><data>%s</data></request>' % ('x' * size)
+        cold_time = min(timeit.repeat(cold, number=1, repeat=repeats))
+        warm_time = min(timeit.repeat(warm, number=1, repeat=repeats))
+        print('%10i %12.3f %12.3f' % (size, cold_time * 1000, warm_time * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+""" Finds the best LTE band lock by measuring signal and throughput for each band combination """
+import re
+import logging
+import xml.etree.ElementTree as ET
+from time import sleep, monotonic
+
+import huawei_lte.xmlobjects as xmlobjects
+from huawei_lte.errors import RouterError
+
+logger = logging.getLogger(__name__)
+
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+#monitoring/status ConnectionStatus once the router is attached
+CONNECTED = 901
+
+def _number(xml, tag):
+    '''Returns the number in a tag's text, e.g. -95.0 for <rsrp>-95dBm</rsrp>, or None'''
+    elm = ET.fromstring(xml).find('./' + tag)
+    if elm is None or not elm.text:
+        return None
+    match = NUMBER_RE.search(elm.text)
+    return float(match.group()) if match else None
+
+class SweepResult(object):
+    '''The samples taken for one band combination'''
+    METRICS = ('rsrp', 'sinr', 'download')
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.samples = []
+        self.score = None
+        self.error = None
+        self.dominated = False
+
+    def mean(self, metric):
+        values = [sample[metric] for sample in self.samples]
+        return sum(values) / len(values) if values else None
+
+    def peak(self, metric):
+        return max(sample[metric] for sample in self.samples) if self.samples else None
+
+class BandSweep(object):
+    '''
+    Locks the router to each candidate LTE band combination in turn, waits for it to reattach,
+    then samples rsrp and sinr from device/signal and the download rate from monitoring/traffic-statistics.
+    The download rate is what the router reports, so run some traffic during the sweep for it to count.
+
+    A candidate is given up once min_samples have been taken and none of its samples beat the
+    best candidate's average on any metric. The candidate already in use is measured first so that
+    no switch is needed for it, and duplicate combinations are only measured once.
+    Finally the best combination is applied, or the original setting is restored if apply_best is False.
+    '''
+    #Score = sum of weight * value, rsrp is offset by 140 so that all values are positive
+    DEFAULT_WEIGHTS = {'rsrp': 0.5, 'sinr': 1.0, 'download': 1.0}
+    RSRP_OFFSET = 140
+
+    def __init__(self, router, candidates, samples=3, min_samples=2, sample_interval=2,
+                 settle_time=5, reattach_timeout=60, weights=None, apply_best=True):
+        if min_samples < 1 or samples < min_samples:
+            raise ValueError('samples must be at least min_samples, and min_samples at least 1')
+        self.router = router
+        self.candidates = candidates
+        self.samples = samples
+        self.min_samples = min_samples
+        self.sample_interval = sample_interval
+        self.settle_time = settle_time
+        self.reattach_timeout = reattach_timeout
+        self.weights = weights if weights is not None else self.DEFAULT_WEIGHTS
+        self.apply_best = apply_best
+        self.best = None
+        self.results = []
+        self.__applied = None
+
+    def __read(self, response):
+        if RouterError.hasError(response):
+            raise ValueError('Band sweep failed: %s' % RouterError(response))
+        return response
+
+    def __current(self):
+        net = xmlobjects.NetworkMode()
+        net.parseXML(self.__read(self.router.net.mode))
+        return net.lte_bands
+
+    def __switch(self, bands):
+        '''Returns False if the router rejected the band setting'''
+        if bands == self.__applied:
+            return True
+        logger.info('Locking %s to LTE bands %s', self.router.router, ', '.join(bands))
+        try:
+            response = self.router.net.set_lte_band({'bands': bands})
+        except RouterError as err:
+            response = err.buildXmlError()
+        if RouterError.hasError(response):
+            logger.warning('Setting LTE bands %s failed: %s', ', '.join(bands), response)
+            return False
+        self.__applied = bands
+        return True
+
+    def __attached(self):
+        status = self.router.device.status
+        if RouterError.hasError(status) or _number(status, 'ConnectionStatus') != CONNECTED:
+            return False
+        signal = self.router.device.signal
+        return not RouterError.hasError(signal) and _number(signal, 'rsrp') is not None
+
+    def __wait_for_attach(self):
+        sleep(self.settle_time)
+        deadline = monotonic() + self.reattach_timeout
+        while True:
+            #Errors are expected while the router reattaches, a router with raise_errors raises them
+            try:
+                if self.__attached():
+                    return True
+            except RouterError as err:
+                logger.debug('%s is not attached: %s', self.router.router, err)
+            if monotonic() >= deadline:
+                return False
+            sleep(min(self.sample_interval, max(deadline - monotonic(), 0)) or 0.1)
+
+    def __sample(self):
+        signal = self.__read(self.router.device.signal)
+        traffic = self.__read(self.router.monitoring.traffic)
+        sample = {
+            'rsrp': _number(signal, 'rsrp'),
+            'sinr': _number(signal, 'sinr'),
+            'download': (_number(traffic, 'CurrentDownloadRate') or 0) * 8 / 1000000 #Mbit/s
+        }
+        if sample['rsrp'] is None or sample['sinr'] is None:
+            return None
+        return sample
+
+    def score(self, sample):
+        values = dict(sample)
+        values['rsrp'] += self.RSRP_OFFSET
+        return sum(weight * values[metric] for metric, weight in self.weights.items())
+
+    def __dominated(self, result):
+        if self.best is None or len(result.samples) < self.min_samples:
+            return False
+        return all(result.peak(metric) <= self.best.mean(metric) for metric in SweepResult.METRICS)
+
+    def __measure(self, result):
+        if not self.__switch(result.bands):
+            result.error = 'Band setting was rejected'
+            return
+        if not self.__wait_for_attach():
+            result.error = 'Not attached within %s seconds' % self.reattach_timeout
+            return
+        while len(result.samples) < self.samples:
+            if result.samples:
+                sleep(self.sample_interval)
+            sample = self.__sample()
+            if sample is None:
+                result.error = 'Signal was not reported'
+                break
+            result.samples.append(sample)
+            if self.__dominated(result):
+                logger.info('LTE bands %s are dominated by %s', ', '.join(result.bands), ', '.join(self.best.bands))
+                result.dominated = True
+                break
+        if not result.samples:
+            return
+        result.score = self.score(dict((metric, result.mean(metric)) for metric in SweepResult.METRICS))
+        if self.best is None or result.score > self.best.score:
+            self.best = result
+
+    def __finish(self, original):
+        if self.apply_best and self.best is not None:
+            target = self.best.bands
+        else:
+            target = original
+        if not self.__switch(target):
+            raise ValueError('Unable to set LTE bands back to %s' % ', '.join(target))
+
+    def run(self):
+        '''Returns the results with the best score first, results that failed are last'''
+        original = self.__current()
+        self.__applied = original
+        self.best = None
+        self.results = []
+        seen = set()
+        for bands in self.candidates:
+            if not isinstance(bands, xmlobjects.BandSet):
+                bands = xmlobjects.BandSet(xmlobjects.NetworkMode.LTE_TABLE, bands)
+            if bands.mask == 0 or bands in seen:
+                continue
+            seen.add(bands)
+            self.results.append(SweepResult(bands))
+        #Measure the current setting first, it needs no switch
+        self.results.sort(key=lambda result: result.bands != original)
+        try:
+            for result in self.results:
+                self.__measure(result)
+        except Exception:
+            #The error that stopped the sweep is raised, not one from setting the bands afterwards
+            try:
+                self.__finish(original)
+            except Exception:
+                logger.exception('Setting LTE bands on %s after the sweep failed', self.router.router)
+            raise
+        self.__finish(original)
+        self.results.sort(key=lambda result: (result.score is None, -(result.score or 0)))
+        return self.results
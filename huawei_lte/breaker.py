@@ -0,0 +1,73 @@
+""" Circuit breaker used to fail fast on unreachable routers """
+import threading
+import logging
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker(object):
+    '''
+    Tracks consecutive connection failures for a single router.
+    CLOSED: calls are passed through to the router
+    OPEN: calls fail immediately until reset_timeout seconds have elapsed
+    HALF_OPEN: a single caller is allowed to probe the router, all others still fail
+    '''
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must be at least 1')
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self): return self.__state
+
+    @property
+    def failures(self): return self.__failures
+
+    def before_call(self):
+        '''
+        Returns the state the caller should act on:
+        CLOSED - make the call, HALF_OPEN - probe the router first, OPEN - fail immediately
+        '''
+        if self.__state == self.CLOSED:
+            return self.CLOSED
+        with self.__lock:
+            if self.__state == self.OPEN and monotonic() - self.__opened_at >= self.reset_timeout:
+                #Only the caller making the transition gets to probe
+                self.__state = self.HALF_OPEN
+                logger.info('Circuit half-open, probing router')
+                return self.HALF_OPEN
+            if self.__state == self.CLOSED:
+                return self.CLOSED
+            return self.OPEN
+
+    def record_success(self):
+        if self.__state == self.CLOSED and self.__failures == 0:
+            return
+        with self.__lock:
+            if self.__state != self.CLOSED:
+                logger.info('Circuit closed, router is reachable')
+            self.__state = self.CLOSED
+            self.__failures = 0
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == self.HALF_OPEN or self.__failures >= self.failure_threshold:
+                if self.__state != self.OPEN:
+                    logger.warning('Circuit opened after %i failure(s)', self.__failures)
+                self.__state = self.OPEN
+                self.__opened_at = monotonic()
+
+    def reset(self):
+        with self.__lock:
+            self.__state = self.CLOSED
+            self.__failures = 0
@@ -0,0 +1,267 @@
+""" A daemon holding logged in router sessions for short lived scripts, and the client used to reach it
+
+    python -m huawei_lte.broker --config routers.json --socket ~/.huawei_lte/broker.sock
+
+routers.json maps each host to its login, {"192.168.8.1": {"username": "admin", "password": "xxx"}},
+and should be readable by the broker's user only. Routers are logged in on first use and stay logged in,
+the router logs in again by itself when the session expires.
+
+A script then uses BrokerRouter much like B525Router, without logging in:
+    router = BrokerRouter('192.168.8.1')
+    router.device.signal
+    router.api('device/signal')
+    router.call('lan.set_settings', {...})
+    router.close()
+
+Requests and responses are single lines of JSON on a UNIX socket created readable by the broker's user only.
+"""
+import os
+import sys
+import json
+import socket
+import signal
+import inspect
+import logging
+import argparse
+import threading
+import socketserver
+
+import huawei_lte.router as lte
+import huawei_lte.xmlobjects as xmlobjects
+import huawei_lte.endpoints as endpoints
+from huawei_lte.utils import escape
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.join('~', '.huawei_lte', 'broker.sock')
+
+#The router modules clients can use, by their attribute name on B525Router
+MODULES = {
+    'device': lte.Device,
+    'lan': lte.Lan,
+    'user': lte.User,
+    'monitoring': lte.Monitoring,
+    'wan': lte.Wan,
+    'security': lte.Security,
+    'dataswitch': lte.Dataswitch,
+    'net': lte.Network,
+    'ethernet': lte.Ethernet,
+    'voip': lte.Voip,
+    'sms': lte.Sms,
+}
+
+class SessionBroker(object):
+    '''
+    Keeps one logged in B525Router per host, shared by every client request.
+    logins: host -> {'username': .., 'password': ..}
+    router_args: passed to each B525Router, e.g. timeout or transport
+    '''
+    def __init__(self, logins, **router_args):
+        self.logins = dict(logins)
+        self.router_args = router_args
+        self.routers = {}
+        self.__logged_in = set()
+        self.__login_locks = {}
+        self.__lock = threading.Lock()
+
+    def router(self, host):
+        '''Returns the logged in router for host, logging in on first use'''
+        with self.__lock:
+            router = self.routers.get(host)
+            if router is None:
+                if host not in self.logins:
+                    raise ValueError('Router [%s] is not configured' % host)
+                router = self.routers[host] = lte.B525Router(host, **self.router_args)
+                self.__login_locks[host] = threading.Lock()
+            lock = self.__login_locks[host]
+        #Each router logs in once, without holding up requests to the others
+        with lock:
+            if host not in self.__logged_in:
+                login = self.logins[host]
+                router.login(login['username'], login['password'])
+                self.__logged_in.add(host)
+        return router
+
+    def handle(self, request):
+        '''Runs a client request, returning the response'''
+        op = request.get('op')
+        if op == 'hosts':
+            return sorted(self.logins)
+        router = self.router(request['host'])
+        if op == 'api':
+            return router.api(request['url'], request.get('data'), request.get('encrypted', False))
+        if op == 'call':
+            return router.call(request['name'], request.get('data'), request.get('encrypted'))
+        if op == 'get':
+            module, _, attr = request['attr'].partition('.')
+            if module not in MODULES or not attr or attr[:1] == '_':
+                raise ValueError('Unknown attribute [%s]' % request['attr'])
+            value = getattr(getattr(router, module), attr)
+            if callable(value):
+                value = value(*request.get('args', ()))
+            if not isinstance(value, (str, int, float, bool, list, dict)) and value is not None:
+                raise ValueError('[%s] does not return a value that can be sent' % request['attr'])
+            return value
+        raise ValueError('Unknown operation [%s]' % op)
+
+    def logout(self):
+        with self.__lock:
+            routers = [self.routers[host] for host in self.__logged_in]
+            self.routers = {}
+            self.__logged_in = set()
+        #One router failing to log out must not keep the others logged in
+        for router in routers:
+            try:
+                router.logout()
+            except Exception as err:
+                logger.warning('Logging out of %s failed: %s', router.router, err)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        #A client can send many requests on one connection
+        for line in self.rfile:
+            try:
+                reply = {'ok': True, 'response': self.server.broker.handle(json.loads(line))}
+            except Exception as err:
+                logger.warning('Broker request failed: %s', err)
+                reply = {'ok': False, 'error': str(err) or err.__class__.__name__}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''Serves a SessionBroker on a UNIX socket, call serve_forever, then shutdown and server_close'''
+    daemon_threads = True
+
+    def __init__(self, broker, path=DEFAULT_SOCKET):
+        self.broker = broker
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(self.path):
+            #A socket left by a broker that did not shut down is removed, a running broker keeps its socket
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                raise OSError('A broker is already listening on %s' % self.path)
+            finally:
+                probe.close()
+        #Only the broker's user can connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class BrokerClient(object):
+    '''A connection to the broker, raises ValueError when the broker reports an error'''
+    def __init__(self, path=DEFAULT_SOCKET, timeout=60):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(os.path.expanduser(path))
+        self.file = self.sock.makefile('rwb')
+        self.__lock = threading.Lock()
+
+    def request(self, **request):
+        with self.__lock:
+            self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise ValueError('The broker closed the connection')
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise ValueError(reply['error'])
+        return reply['response']
+
+    def hosts(self):
+        return self.request(op='hosts')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+class _ModuleProxy(object):
+    '''Reads a router module's accessors and properties, and calls its methods, through the broker'''
+    def __init__(self, router, name):
+        self._router = router
+        self._name = name
+
+    def __getattr__(self, attr):
+        static = inspect.getattr_static(MODULES[self._name], attr, None)
+        if static is None or attr[:1] == '_':
+            raise AttributeError(attr)
+        name = '%s.%s' % (self._name, attr)
+        if (isinstance(static, endpoints.accessor) and static.call) or inspect.isfunction(static):
+            return lambda *args: self._router._get(name, args)
+        return self._router._get(name, ())
+
+class BrokerRouter(object):
+    '''
+    Stands in for a logged in B525Router, the broker makes the requests.
+    As with B525Router, errors are returned as XML
+    '''
+    def __init__(self, host, path=DEFAULT_SOCKET, client=None):
+        self.router = host
+        self.client = client if client is not None else BrokerClient(path)
+        for name in MODULES:
+            setattr(self, name, _ModuleProxy(self, name))
+
+    def __send(self, caller, **request):
+        try:
+            return self.client.request(host=self.router, **request)
+        except (ValueError, OSError) as err:
+            return xmlobjects.Error.xml_error(caller, escape(str(err)))
+
+    def api(self, url, data=None, encrypted=False):
+        if isinstance(data, xmlobjects.XmlObject):
+            data = data.buildXML()
+        return self.__send('api', op='api', url=url, data=data, encrypted=encrypted)
+
+    def call(self, name, data=None, encrypted=None):
+        if isinstance(data, xmlobjects.XmlObject):
+            data = data.buildXML()
+        return self.__send('call', op='call', name=name, data=data, encrypted=encrypted)
+
+    def _get(self, attr, args):
+        return self.__send(attr, op='get', attr=attr, args=list(args))
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m huawei_lte.broker', description='Keeps routers logged in for other processes')
+    parser.add_argument('--config', required=True, help='JSON file of host -> {"username": .., "password": ..}')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='UNIX socket to listen on')
+    args = parser.parse_args(argv)
+    with open(args.config) as f:
+        logins = json.load(f)
+    broker = SessionBroker(logins)
+    server = BrokerServer(broker, args.socket)
+    #serve_forever blocks, so SIGTERM stops it from another thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    logger.info('Broker listening on %s for %i router(s)', server.path, len(logins))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        broker.logout()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,10 +2,34 @@ import uuid
 import hashlib
 import hmac
 from binascii import hexlify
-import math
 import base64
-from Crypto.Cipher import PKCS1_v1_5
-from Crypto.PublicKey.RSA import construct
+from functools import lru_cache
+
+#Executor for CPU heavy work, None runs it in the calling thread
+_executor = None
+
+def set_executor(executor):
+    """
+    Runs PBKDF2 and RSA encryption on a concurrent.futures executor, None runs them in the calling thread.
+    A ThreadPoolExecutor suits PBKDF2 as hashlib releases the GIL while hashing,
+    a ProcessPoolExecutor also spreads RSA encryption over all cores.
+    Arguments, including the password, are passed to the worker processes.
+    """
+    global _executor
+    _executor = executor
+
+def use_process_pool(max_workers=None):
+    """ sets and returns a ProcessPoolExecutor for crypto work, for logging in to many routers at once """
+    from concurrent.futures import ProcessPoolExecutor
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    set_executor(executor)
+    return executor
+
+def _run(func, *args):
+    executor = _executor
+    if executor is None:
+        return func(*args)
+    return executor.submit(func, *args).result()
 
 def generate_nonce():
     """ generate random clientside nonce """
@@ -13,6 +37,9 @@ def generate_nonce():
 
 def get_client_proof(clientnonce, servernonce, password, salt, iterations):
     """ calculates server client proof (part of the SCRAM algorithm) """
+    return _run(_client_proof, clientnonce, servernonce, password, salt, iterations)
+
+def _client_proof(clientnonce, servernonce, password, salt, iterations):
     msg = "%s,%s,%s" % (clientnonce, servernonce, servernonce)
     salted_pass = hashlib.pbkdf2_hmac(
         'sha256', password.encode('utf_8'), bytearray.fromhex(salt), iterations)
@@ -31,21 +58,35 @@ def get_client_proof(clientnonce, servernonce, password, salt, iterations):
         i = i + 1
     return hexlify(client_proof)
 
-def rsa_encrypt(rsae, rsan, data):
-    if (data is None or data == ''): return ''
+@lru_cache(maxsize=256)
+def _rsa_cipher(rsae, rsan):
+    '''
+    Returns the PKCS1 v1.5 cipher and key size in bytes for a router's public key.
+    Routers issue a new key on each login, so the cache holds one entry per active session
+    '''
+    #Only needed for encrypted requests, so imported on first use
+    from Crypto.Cipher import PKCS1_v1_5
+    from Crypto.PublicKey.RSA import construct
     N = int(rsan,16)
     E = int(rsae,16)
+    cipher = PKCS1_v1_5.new(construct((N, E)))
+    return cipher, (N.bit_length() + 7) // 8
+
+def rsa_encrypt(rsae, rsan, data):
+    ''' encrypts data with the router's public key, returned as hex '''
+    if (data is None or data == ''): return ''
+    return _run(_rsa_encrypt, rsae, rsan, data)
+
+def _rsa_encrypt(rsae, rsan, data):
+    if isinstance(data, str):
+        data = data.encode('utf_8')
     b64data = base64.b64encode(data)
-    pubkey = construct((N, E))
-    cipher = PKCS1_v1_5.new(pubkey)
-    blocks = int(math.ceil(len(b64data) / 245.0))
-    result = []
+    cipher, key_size = _rsa_cipher(rsae, rsan)
+    #PKCS1 v1.5 padding takes 11 bytes of each block
+    block_size = key_size - 11
+    blocks = (len(b64data) + block_size - 1) // block_size
+    result = bytearray(blocks * key_size)
     for i in range(blocks):
-        block = b64data[i*245:(i+1)*245]
-        d = cipher.encrypt(block)
-        result.append(d)
-    result = hexlify(''.join(result))
-    if ((len(result) & 1) == 0):
-        return result
-    else:
-        return '0'+result
+        block = b64data[i*block_size:(i+1)*block_size]
+        result[i*key_size:(i+1)*key_size] = cipher.encrypt(block)
+    return hexlify(result).decode('ascii')
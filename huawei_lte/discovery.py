@@ -0,0 +1,201 @@
+""" Finds Huawei LTE routers on a network and writes an inventory of them
+
+    python -m huawei_lte.discovery 10.20.0.0/16 10.21.4.0/24 -o inventory.json
+    HUAWEI_LTE_PASSWORD=xxx python -m huawei_lte.discovery 10.20.0.0/16 --username admin --features -o inventory.json
+
+Hosts are scanned by a fixed number of asyncio workers with short timeouts, so a /16 takes minutes.
+A host is a router if its unauthenticated api/webserver/token returns a <token> response and its / page
+answers. Other web UIs can answer like this, so entries record huawei, whether either names Huawei, and
+callers should check it. With features, each router identified as Huawei is logged in to
+and probed with B525Router.features on a small thread pool.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import ipaddress
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATH = '/api/webserver/token'
+MAX_RESPONSE = 65536
+
+async def _read(reader):
+    #Reads until the server closes the connection, keeping at most MAX_RESPONSE bytes
+    response = b''
+    while len(response) < MAX_RESPONSE:
+        chunk = await reader.read(MAX_RESPONSE - len(response))
+        if not chunk:
+            break
+        response += chunk
+    return response
+
+async def _http_get(ip, port, path, timeout):
+    '''Returns (status, headers, body) for a GET over a new connection, or None if the host does not answer'''
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        writer.write(('GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n' % (path, ip)).encode('ascii'))
+        response = await asyncio.wait_for(_read(reader), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        status = int(lines[0].split()[1])
+    except (IndexError, ValueError):
+        return None
+    headers = dict((key.strip().lower(), value.strip()) for key, _, value in (line.partition(':') for line in lines[1:]))
+    return status, headers, body.decode('utf-8', 'replace')
+
+def _is_token(body):
+    try:
+        root = ET.fromstring(body.strip())
+    except ET.ParseError:
+        return False
+    return root.tag == 'response' and bool(root.findtext('token'))
+
+async def identify(ip, port=80, timeout=1.0):
+    '''
+    Returns the inventory entry for a router at ip, or None if there is no router API there.
+    The entry's huawei flag is False when neither response names Huawei, callers should check it
+    '''
+    token = await _http_get(ip, port, TOKEN_PATH, timeout)
+    if token is None or token[0] != 200 or not _is_token(token[2]):
+        return None
+    #The web UI's / page sets the session cookie, an API without it is not a router
+    index = await _http_get(ip, port, '/', timeout)
+    if index is None or index[0] >= 400:
+        return None
+    #The host as B525Router expects it, IPv6 addresses are bracketed in URLs
+    host = '[%s]' % ip if ':' in ip else ip
+    return {
+        'host': host if port == 80 else '%s:%i' % (host, port),
+        'server': token[1].get('server', ''),
+        'huawei': 'huawei' in index[2].lower() or 'huawei' in token[1].get('server', '').lower()
+    }
+
+def _hosts(networks):
+    for network in networks:
+        network = ipaddress.ip_network(network, strict=False)
+        hosts = [network.network_address] if network.num_addresses == 1 else network.hosts()
+        for ip in hosts:
+            yield str(ip)
+
+async def scan(networks, port=80, concurrency=256, timeout=1.0):
+    '''
+    Returns the inventory entries of the routers found in networks, a list of CIDR ranges
+    concurrency: hosts scanned at once, each scan waits at most timeout seconds per connection and read
+    '''
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    hosts = _hosts(networks)
+    found = []
+    #Workers share the host generator, so memory does not grow with the size of the networks
+    async def worker():
+        for ip in hosts:
+            entry = await identify(ip, port, timeout)
+            if entry is not None:
+                logger.info('Found router at %s', entry['host'])
+                found.append((ipaddress.ip_address(ip), entry))
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    found.sort(key=lambda item: (item[0].version, item[0]))
+    return [entry for _, entry in found]
+
+def _features(host, username, password, transport):
+    #Imported here so that scanning does not need the router's dependencies
+    import huawei_lte.router as lte
+    router = lte.B525Router(host, transport=transport)
+    logged_in = False
+    try:
+        router.login(username, password)
+        logged_in = True
+        root = ET.fromstring(router.features)
+    except Exception as err:
+        return {'error': str(err)}
+    finally:
+        #The router allows few sessions, so one left open can lock out its users
+        if logged_in:
+            try:
+                router.logout()
+            except Exception as err:
+                logger.warning('Logging out of %s failed: %s', host, err)
+    return {
+        'device_name': root.findtext('DeviceName'),
+        'hardware_version': root.findtext('HardwareVersion'),
+        'software_version': root.findtext('SoftwareVersion'),
+        'webui_version': root.findtext('WebUIVersion'),
+        'passed': [func.findtext('Name') for func in root.findall('Passed/Function')],
+        'failed': dict((func.findtext('Name'), func.findtext('Error')) for func in root.findall('Failed/Function'))
+    }
+
+def probe_features(entries, username, password, concurrency=8):
+    '''
+    Adds the results of B525Router.features to the inventory entries identified as Huawei routers,
+    logins are blocking so use threads
+    '''
+    from huawei_lte.transport import Transport
+    #The login sends the username and a proof of the password, so other web UIs are not sent it
+    huawei = [entry for entry in entries if entry['huawei']]
+    transport = Transport(pool_connections=concurrency, pool_maxsize=1)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(lambda entry: _features(entry['host'], username, password, transport), huawei)
+        for entry, features in zip(huawei, results):
+            entry['features'] = features
+    transport.close()
+    return entries
+
+def discover(networks, port=80, concurrency=256, timeout=1.0, username=None, password=None, features_concurrency=8):
+    '''Scans networks, and if a password is given probes the features of the Huawei routers found'''
+    entries = asyncio.run(scan(networks, port, concurrency, timeout))
+    if password is not None:
+        probe_features(entries, username, password, features_concurrency)
+    return entries
+
+def write_inventory(path, entries, networks=()):
+    inventory = {
+        'scanned': [str(network) for network in networks],
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'routers': entries
+    }
+    #Written to a temporary file first, so readers never see a partial inventory
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(inventory, f, indent=2)
+    os.replace(temp, path)
+
+def read_inventory(path):
+    '''Returns the router entries of an inventory file'''
+    with open(path) as f:
+        return json.load(f)['routers']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m huawei_lte.discovery', description='Finds Huawei LTE routers')
+    parser.add_argument('networks', nargs='+', help='CIDR ranges to scan, e.g. 10.20.0.0/16')
+    parser.add_argument('-o', '--output', default='inventory.json', help='inventory file to write')
+    parser.add_argument('--port', type=int, default=80)
+    parser.add_argument('--concurrency', type=int, default=256, help='hosts scanned at once')
+    parser.add_argument('--timeout', type=float, default=1.0, help='seconds to wait for a connection or response')
+    parser.add_argument('--features', action='store_true', help='log in to the Huawei routers found and probe features, the password is read from HUAWEI_LTE_PASSWORD')
+    parser.add_argument('--username', default='admin')
+    args = parser.parse_args(argv)
+    password = None
+    if args.features:
+        password = os.environ.get('HUAWEI_LTE_PASSWORD')
+        if password is None:
+            parser.error('HUAWEI_LTE_PASSWORD must be set to probe features')
+    start = time.monotonic()
+    entries = discover(args.networks, args.port, args.concurrency, args.timeout, args.username, password)
+    write_inventory(args.output, entries, args.networks)
+    print('Found %i router(s) in %.0fs, written to %s' % (len(entries), time.monotonic() - start, args.output))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+""" The router API endpoints, with the metadata needed to call, cache, retry and probe them """
+
+GET = 'GET'
+POST = 'POST'
+
+class Endpoint(object):
+    '''
+    module: name of the RouterObject class the endpoint belongs to, e.g. Device
+    attr: accessor or method name on that class, the endpoint's name is module.attr in lower case
+    idempotent: safe to send twice, defaults to True for GET and False for POST
+    ttl: seconds a response can be cached for, 0 if it should always be read
+    probe: GET endpoints that features calls to test what the router supports
+    '''
+    __slots__ = ('name', 'module', 'attr', 'path', 'method', 'encrypted', 'idempotent', 'ttl', 'probe')
+
+    def __init__(self, module, attr, path, method=GET, encrypted=False, idempotent=None, ttl=0, probe=None):
+        self.module = module
+        self.attr = attr
+        self.name = '%s.%s' % (module.lower(), attr)
+        self.path = path
+        self.method = method
+        self.encrypted = encrypted
+        self.idempotent = method == GET if idempotent is None else idempotent
+        self.ttl = ttl
+        self.probe = method == GET if probe is None else probe
+
+    def __repr__(self):
+        return 'Endpoint(%s %s %s)' % (self.name, self.method, self.path)
+
+ENDPOINTS = (
+    Endpoint('Lan', 'settings', 'dhcp/settings', ttl=60),
+    Endpoint('Lan', 'static_hosts', 'dhcp/static-addr-info', ttl=60),
+    Endpoint('Lan', 'clients', 'wlan/host-list', ttl=10),
+    Endpoint('Lan', 'all_clients', 'lan/HostInfo', ttl=10),
+    Endpoint('Lan', 'set_settings', 'dhcp/settings', POST),
+    Endpoint('Lan', 'set_static_hosts', 'dhcp/static-addr-info', POST),
+
+    Endpoint('User', 'last_login', 'user/history-login', ttl=60),
+    Endpoint('User', 'logout', 'user/logout', POST),
+
+    Endpoint('Voip', 'status', 'voice/voicebusy', ttl=2),
+    Endpoint('Voip', 'voip_options', 'voice/voipadvance', ttl=300),
+    Endpoint('Voip', 'feature_switch', 'voice/featureswitch', ttl=300),
+    Endpoint('Voip', 'sip_accounts', 'voice/sipaccount', ttl=60),
+    Endpoint('Voip', 'sip_options', 'voice/sipadvance', ttl=300),
+    Endpoint('Voip', 'sipserver', 'voice/sipserver', ttl=300),
+    Endpoint('Voip', 'voice_settings', 'voice/voice-basic-settings', ttl=300),
+    Endpoint('Voip', 'add_account', 'voice/addipaccount', POST, encrypted=True),
+    Endpoint('Voip', 'remove_account', 'voice/deletesipaccount', POST, encrypted=True),
+    Endpoint('Voip', 'set_sip_options', 'voice/sipadvanced', POST),
+    Endpoint('Voip', 'set_sip_server', 'voice/sipserver', POST),
+    Endpoint('Voip', 'set_voice_settings', 'voice/voice-basic-settings', POST),
+
+    Endpoint('Ethernet', 'settings', 'cradle/basic-info', ttl=60),
+    Endpoint('Ethernet', 'status', 'cradle/status-info', ttl=5),
+    #Encrypted when a PPPoE password is sent
+    Endpoint('Ethernet', 'set_settings', 'cradle/basic-info', POST),
+
+    Endpoint('Device', 'info', 'device/information', ttl=3600),
+    Endpoint('Device', 'signal', 'device/signal', ttl=2),
+    Endpoint('Device', 'status', 'monitoring/status', ttl=2),
+    Endpoint('Device', 'circleled', 'led/circle-switch', ttl=300),
+    #Returns Not supported error on B525
+    Endpoint('Device', 'bridgemode', 'security/bridgemode', ttl=300),
+    Endpoint('Device', 'control', 'device/control', POST),
+
+    Endpoint('Dataswitch', 'set_dataswitch', 'dialup/mobile-dataswitch', POST, idempotent=True),
+
+    Endpoint('Network', 'mode', 'net/net-mode', ttl=60),
+    Endpoint('Network', 'modelist', 'net/net-mode-list', ttl=3600),
+    Endpoint('Network', 'set_mode', 'net/net-mode', POST, idempotent=True),
+
+    Endpoint('Security', 'macfilter', 'security/mac-filter', ttl=60),
+    Endpoint('Security', 'timerule', 'timerule/timerule', ttl=300),
+    Endpoint('Security', 'set_macfilter', 'security/mac-filter', POST, idempotent=True),
+
+    Endpoint('Monitoring', 'traffic', 'monitoring/traffic-statistics', ttl=1),
+    Endpoint('Monitoring', 'stats', 'monitoring/month_statistics', ttl=60),
+    Endpoint('Monitoring', 'notifications', 'monitoring/check-notifications', ttl=1),
+    Endpoint('Monitoring', 'trafficalert', 'monitoring/start_date', ttl=300),
+    Endpoint('Monitoring', 'clear_traffic', 'monitoring/clear-traffic', POST),
+    Endpoint('Monitoring', 'set_trafficalert', 'monitoring/start_date', POST, idempotent=True),
+
+    Endpoint('Sms', 'count', 'sms/sms-count', ttl=5),
+    #Reads a page of messages, POST because the page is in the request
+    Endpoint('Sms', 'list', 'sms/sms-list', POST, idempotent=True),
+    Endpoint('Sms', 'delete', 'sms/delete-sms', POST, idempotent=True),
+    Endpoint('Sms', 'set_read', 'sms/set-read', POST, idempotent=True),
+
+    Endpoint('Wan', 'port_forwards', 'security/virtual-servers', ttl=60),
+    Endpoint('Wan', 'ddns', 'ddns/ddns-list', ttl=60),
+    Endpoint('Wan', 'set_port_forwards', 'security/virtual-servers', POST, idempotent=True),
+    Endpoint('Wan', 'set_ddns', 'ddns/ddns-list', POST, encrypted=True),
+)
+
+BY_NAME = dict((endpoint.name, endpoint) for endpoint in ENDPOINTS)
+
+def lookup(name):
+    endpoint = BY_NAME.get(name)
+    if endpoint is None:
+        raise ValueError('Unknown endpoint [%s]' % name)
+    return endpoint
+
+def probes():
+    '''The GET endpoints used to test which functions the router supports'''
+    return [endpoint for endpoint in ENDPOINTS if endpoint.probe]
+
+class accessor(object):
+    '''
+    Reads a GET endpoint when accessed on a RouterObject, e.g. info = accessor('device.info').
+    Set call=True for accessors that are called as methods, router.security.timerule()
+    '''
+    def __init__(self, name, call=False):
+        self.endpoint = lookup(name)
+        self.call = call
+        self.__doc__ = 'GET %s' % self.endpoint.path
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        if self.call:
+            return lambda: obj.router.call(self.endpoint.name)
+        return obj.router.call(self.endpoint.name)
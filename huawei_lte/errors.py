@@ -1,9 +1,15 @@
-import huawei_lte.xmlobjects as xmlobjects
+import xml.etree.ElementTree as ET
 
 class RouterError(Exception):
+    '''
+    An error response from the router, or from this API.
+    RouterError.fromResponse and fromCode return the subclass for the code, e.g. RouterSessionError
+    '''
 
-    __ERRORS = [
+    __ERRORS = dict([
         [2000, 'Python API: %s - %s'],
+        [2001, 'Python API: Router %s is unavailable, requests are suspended'],
+        [2002, 'Python API: The poll request was dropped after waiting too long for the router'],
         [100001, 'An unkown error occurred'],
         [100002, 'No such URL. The router does not support this function'],
         [100003, 'You have no rights to access this function'],
@@ -44,19 +50,65 @@ class RouterError(Exception):
         [125002, 'Invalid session'],
         [125003, 'Invalid session token']
         #TODO: Add 9003 occurring when setting static ip addresses
-    ]
+    ])
+    #Subclasses register their codes here, see below
+    _TYPES = {}
 
     @classmethod
     def hasError(cls, xml): return '<error>' in xml
 
     @classmethod
     def getErrorMessage(cls, code):
-        code = int(code)
-        return next((err[1] for err in cls.__ERRORS if err[0] == code), 'An unknown error occurred')
-
-    def __init__(self, response):
-        error = xmlobjects.Error()
-        error.parseXML(response)
-        self.code = error.code
-        self.message = error.message
+        return cls.__ERRORS.get(int(code), 'An unknown error occurred')
+
+    @classmethod
+    def fromCode(cls, code, message=None):
+        '''Returns the RouterError subclass instance for code'''
+        error_type = RouterError._TYPES.get(int(code), RouterError)
+        return error_type(code=code, message=message)
+
+    @classmethod
+    def fromResponse(cls, response):
+        '''Returns the RouterError subclass instance for an <error> response'''
+        root = ET.fromstring(response)
+        return cls.fromCode(root.findtext('code', '0').strip(), root.findtext('message'))
+
+    def __init__(self, response=None, code=None, message=None):
+        if response is not None:
+            root = ET.fromstring(response)
+            code = root.findtext('code', '0').strip()
+            message = root.findtext('message')
+        self.code = str(code)
+        self.message = message if message else self.getErrorMessage(code)
         super(RouterError, self).__init__(self.code +": "+self.message)
+
+    def buildXmlError(self):
+        #xmlobjects imports this module
+        from huawei_lte.xmlobjects import Error
+        return Error(self.code, self.message).buildXmlError()
+
+def _register(error_type, codes):
+    for code in codes:
+        RouterError._TYPES[code] = error_type
+    return error_type
+
+class RouterBusyError(RouterError):
+    '''The router, or its voice service, is busy, try again later'''
+
+class RouterAuthError(RouterError):
+    '''The login was refused'''
+
+class RouterSessionError(RouterError):
+    '''The session or its verification token is no longer valid'''
+
+class RouterUnsupportedError(RouterError):
+    '''The router does not support the function'''
+
+class RouterUnavailableError(RouterError):
+    '''The router is not reachable and requests are suspended'''
+
+_register(RouterBusyError, [100004, 120001, 2002])
+_register(RouterAuthError, [108001, 108002, 108003, 108004, 108005, 108006, 108007, 108010, 125001])
+_register(RouterSessionError, [100003, 125002, 125003])
+_register(RouterUnsupportedError, [100002])
+_register(RouterUnavailableError, [2001])
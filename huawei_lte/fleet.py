@@ -0,0 +1,51 @@
+""" Operations across many routers """
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import huawei_lte.xmlobjects as xmlobjects
+from huawei_lte.utils import escape
+from huawei_lte.errors import RouterError
+
+logger = logging.getLogger(__name__)
+
+def rolling_reboot(routers, concurrency=1, max_failures=0, down_timeout=60, ready_timeout=300):
+    '''
+    Reboots logged in routers, with at most concurrency routers restarting at any one time.
+    A new reboot starts as soon as a previous router is ready again.
+    Once more than max_failures routers fail to come back, no further reboots are started.
+    Returns a dictionary of router host -> response (device information or an error)
+    '''
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    results = {}
+    failures = 0
+    pending = list(routers)
+    pending.reverse()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < concurrency and failures <= max_failures:
+                router = pending.pop()
+                logger.info('Rebooting %s', router.router)
+                future = executor.submit(router.reboot, down_timeout, ready_timeout)
+                running[future] = router
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                router = running.pop(future)
+                #Routers created with raise_errors raise instead of returning an error response
+                try:
+                    response = future.result()
+                except RouterError as err:
+                    response = err.buildXmlError()
+                except Exception as err:
+                    response = xmlobjects.Error.xml_error('rolling_reboot', escape(str(err) or err.__class__.__name__))
+                if RouterError.hasError(response):
+                    failures += 1
+                    logger.warning('Reboot of %s failed: %s', router.router, response)
+                results[router.router] = response
+    for router in pending:
+        results[router.router] = xmlobjects.Error.xml_error(
+            'rolling_reboot', 'Skipped after %i failed reboot(s)' % failures)
+    return results
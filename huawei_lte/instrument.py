@@ -0,0 +1,125 @@
+""" Timing hooks for the router's hot paths, they cost a single check until an instrument is added
+
+    collector = instrument.HistogramCollector()
+    instrument.add(collector)
+    ...
+    collector.summary()
+
+Instruments are callables taking (name, duration, info). The names are:
+    api             B525Router.api, info has url, bytes and code (the router error code, if any)
+    login, relogin  a full SCRAM login, and logins made because the session expired or was rejected
+    token           fetching a verification token
+    http.get/post   sending a request and reading the response, info has url, status, bytes and bytes_sent
+    decode          decoding the response body to text
+    encrypt         RSA encryption of request data
+    parse.<class>   XmlObject.parseXML for the class, info has bytes
+    build.<class>   XmlObject.buildXML for the class
+"""
+import re
+import logging
+import threading
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+#Replaced rather than modified, so recording never needs the lock
+_instruments = ()
+_lock = threading.Lock()
+
+ERROR_CODE_RE = re.compile(r'<error>\s*<code>\s*(\d+)\s*</code>')
+
+def add(inst):
+    global _instruments
+    with _lock:
+        _instruments = _instruments + (inst,)
+
+def remove(inst):
+    global _instruments
+    with _lock:
+        _instruments = tuple(i for i in _instruments if i is not inst)
+
+def enabled():
+    return bool(_instruments)
+
+def clock():
+    '''Returns the start time for record, or None if there are no instruments'''
+    return perf_counter() if _instruments else None
+
+def record(name, start, **info):
+    duration = perf_counter() - start
+    for inst in _instruments:
+        try:
+            inst(name, duration, info)
+        except Exception:
+            logger.exception('Instrument %r failed', inst)
+
+def error_code(response):
+    '''Returns the error code of an XML error response, or None'''
+    if response is None:
+        return None
+    match = ERROR_CODE_RE.search(response)
+    return int(match.group(1)) if match else None
+
+class Histogram(object):
+    '''Counts durations in power of two microsecond buckets'''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = {}
+        self.errors = {}
+
+    def add(self, duration, info):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        bucket = int(duration * 1000000).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.bytes += info.get('bytes') or 0
+        code = info.get('code')
+        if code is not None:
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+    def percentile(self, p):
+        '''Returns the upper bound in seconds of the bucket holding the p'th percentile'''
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((1 << bucket) / 1000000.0, self.max)
+        return self.max
+
+class HistogramCollector(object):
+    '''An instrument keeping a histogram per name in memory, safe to use from multiple threads'''
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.histograms = {}
+
+    def __call__(self, name, duration, info):
+        with self.__lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(duration, info)
+
+    def reset(self):
+        with self.__lock:
+            self.histograms = {}
+
+    def summary(self):
+        '''Returns name -> {count, total, mean, p50, p95, max, bytes, errors}, times are in seconds'''
+        with self.__lock:
+            return dict((name, {
+                'count': h.count,
+                'total': h.total,
+                'mean': h.total / h.count,
+                'p50': h.percentile(50),
+                'p95': h.percentile(95),
+                'max': h.max,
+                'bytes': h.bytes,
+                'errors': dict(h.errors)
+            }) for name, h in self.histograms.items())
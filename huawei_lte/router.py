@@ -1,52 +1,53 @@
 ﻿""" Huawei router commands  """
 import xml.etree.ElementTree as ET
 import sys
-from time import sleep
-from xml.sax.saxutils import escape
-import requests
+import time
+from time import sleep, monotonic
 import logging
-from datetime import datetime, timedelta
 import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 #Local imports
 import huawei_lte.xmlobjects as xmlobjects
 import huawei_lte.utils as utils
+import huawei_lte.instrument as instrument
+import huawei_lte.wiretrace as wiretrace
+import huawei_lte.endpoints as endpoints
+from huawei_lte.utils import escape
 from huawei_lte.errors import RouterError
-import huawei_lte.crypto as crypto
+from huawei_lte.breaker import CircuitBreaker
+from huawei_lte.bandsweep import BandSweep
+import huawei_lte.scheduler as scheduler
 
-logger = logging.getLogger(__name__)
-
-#Dictionary to hold all GET APIS, used by testFeatures function
-GET_APIS = []
+#requests and the crypto functions are only imported once they are first used
+requests = utils.LazyModule('requests')
+crypto = utils.LazyModule('huawei_lte.crypto')
 
-#Decorator for GET API functions, populates the GET_APIS dictionary
-def get_api(cls, api):
-    '''Designate function as a GET API call'''
-    def api_decorator(f):
-        GET_APIS.append([cls, f.__name__, api])
-        def decorated_function(*args):
-            try:
-                inst = args[0]
-                if issubclass(type(inst), RouterObject):
-                    return inst.router.api(api)
-                return inst.api(api)
-            except ValueError as err:
-                return xmlobjects.Error.xml_error(f.__name__, escape(str(err)))
-            except:
-                logger.exception('message')
-                msg = 'Unexpected error: %s' % sys.exc_info()[0]
-                return xmlobjects.Error.xml_error(f.__name__, escape(msg))
-        return decorated_function
-    return api_decorator
+logger = logging.getLogger(__name__)
 
 def post_api(f):
-    '''Decorator to ensure any errors are returned as an XML response'''
+    '''
+    Decorator to ensure any errors are returned as an XML response,
+    unless the router was created with raise_errors=True, when RouterError, ValueError
+    and the connection errors and timeouts of requests are raised
+    '''
+    def raise_errors(inst):
+        router = inst.router if isinstance(inst, RouterObject) else inst
+        return getattr(router, 'raise_errors', False)
+
     def decorated_function(*args, **kwargs):
         try:
             return f(*args, **kwargs)
-        except ValueError as err:
+        except (RouterError, ValueError) as err:
+            if raise_errors(args[0]):
+                raise
+            if isinstance(err, RouterError):
+                return err.buildXmlError()
             return xmlobjects.Error.xml_error(f.__name__, escape(str(err)))
         except:
+            if raise_errors(args[0]) and isinstance(sys.exc_info()[1], requests.exceptions.RequestException):
+                raise
             logger.exception('message')
             msg = 'Unexpected error: %s' % sys.exc_info()[0]
             return xmlobjects.Error.xml_error(f.__name__, escape(msg))
@@ -59,6 +60,7 @@ class RouterObject(object):
         self.router = router
         self.api = router.api
         self.enc_api = router.enc_api
+        self.call = router.call
 
     @classmethod
     def _get_param(cls, vals, key, default=None):
@@ -69,36 +71,38 @@ class Dataswitch(RouterObject):
     def set_dataswitch_on(self):
         dataswitch = xmlobjects.DataswitchMode()
         dataswitch.set_dataswitch_on()
-        return self.api('dialup/mobile-dataswitch', dataswitch)
+        return self.call('dataswitch.set_dataswitch', dataswitch)
     
     @post_api
     def set_dataswitch_off(self):
         dataswitch = xmlobjects.DataswitchMode()
         dataswitch.set_dataswitch_off()
-        return self.api('dialup/mobile-dataswitch', dataswitch)
+        return self.call('dataswitch.set_dataswitch', dataswitch)
 
 class Lan(RouterObject):
     '''LAN module'''
+    settings = endpoints.accessor('lan.settings')
+    static_hosts = endpoints.accessor('lan.static_hosts')
+    clients = endpoints.accessor('lan.clients')
+    all_clients = endpoints.accessor('lan.all_clients')
 
-    @property
-    @get_api(cls='Lan', api='dhcp/settings')
-    def settings(self): pass
+    #Streamed versions of the lists above, entries are yielded as they arrive and errors raise RouterError
+    def iter_clients(self):
+        '''Yields the XML of each <Host> connected to wifi'''
+        return self.router.iter_api('wlan/host-list', 'Hosts')
 
-    @property
-    @get_api(cls='Lan', api='dhcp/static-addr-info')
-    def static_hosts(self): pass
+    def iter_all_clients(self):
+        '''Yields the XML of each known <Host>'''
+        return self.router.iter_api('lan/HostInfo', 'Hosts')
 
-    @property
-    @get_api(cls='Lan', api='wlan/host-list')
-    def clients(self): pass
-
-    @property
-    @get_api(cls='Lan', api='lan/HostInfo')
-    def all_clients(self): pass
+    def iter_static_hosts(self):
+        '''Yields a StaticHost for each static DHCP address'''
+        hosts = xmlobjects.StaticHostCollection()
+        return (hosts.child('Hosts', xml) for xml in self.router.iter_api('dhcp/static-addr-info', 'Hosts'))
 
     @post_api
     def set_settings(self, config):
-        return self.api('dhcp/settings', config)
+        return self.call('lan.set_settings', config)
 
     @post_api
     def set_dhcp_off(self):
@@ -106,7 +110,7 @@ class Lan(RouterObject):
         settings = xmlobjects.LanSettings()
         settings.parseXML(self.settings)
         settings.setDhcpOff()
-        return self.api('dhcp/settings', settings)
+        return self.call('lan.set_settings', settings)
 
     @post_api
     def set_dhcp(self, config):
@@ -118,7 +122,7 @@ class Lan(RouterObject):
         settings = xmlobjects.LanSettings()
         settings.parseXML(self.settings)
         settings.setDhcpOn(config)
-        return self.api('dhcp/settings', settings)
+        return self.call('lan.set_settings', settings)
 
     @post_api
     def set_ipaddress(self, config):
@@ -130,7 +134,7 @@ class Lan(RouterObject):
         settings = xmlobjects.LanSettings()
         settings.parseXML(self.settings)
         settings.setLanAddress(config)
-        return self.api('dhcp/settings', settings)
+        return self.call('lan.set_settings', settings)
 
     @post_api
     def set_dns(self, config):
@@ -142,7 +146,7 @@ class Lan(RouterObject):
         settings = xmlobjects.LanSettings()
         settings.parseXML(self.settings)
         settings.setDnsManual(config)
-        return self.api('dhcp/settings', settings)
+        return self.call('lan.set_settings', settings)
 
     @post_api
     def set_dns_auto(self):
@@ -152,7 +156,7 @@ class Lan(RouterObject):
         settings = xmlobjects.LanSettings()
         settings.parseXML(self.settings)
         settings.setDnsAutomatic()
-        return self.api('dhcp/settings', settings)
+        return self.call('lan.set_settings', settings)
 
     @post_api
     def add_static_host(self, config):
@@ -168,7 +172,7 @@ class Lan(RouterObject):
                 settings.addHost(host)
         else:
             settings.addHost(config)
-        return self.api('dhcp/static-addr-info', settings)
+        return self.call('lan.set_static_hosts', settings)
 
     @post_api
     def remove_static_host(self, config):
@@ -184,42 +188,55 @@ class Lan(RouterObject):
                 settings.removeHost(cfg['macaddress'])
         else:
             settings.removeHost(config['macaddress'])
-        return self.api('dhcp/static-addr-info', settings)
+        return self.call('lan.set_static_hosts', settings)
+
+    @post_api
+    def sync_static_hosts(self, config):
+        '''
+        Makes the static hosts match config, all addresses are validated before anything is sent
+        {'92:1b:46:9d:be:86': '192.168.8.100', '92:1b:46:9d:be:87': '192.168.8.102'}
+        [{'macaddress': 'xxx', 'ipaddress': 'xxx'}, {'macaddress': 'xxx', 'ipaddress': 'xxx'}]
+        Returns the MAC addresses of the added, removed and changed hosts
+        <Added><MacAddress>xxx</MacAddress></Added><Removed /><Changed />
+        '''
+        if isinstance(config, list):
+            #Duplicates are found by sync, once the MAC addresses are normalised
+            mac, ip = xmlobjects.StaticHost.P_MAC_ADDRESS, xmlobjects.StaticHost.P_IP_ADDRESS
+            config = [(self._get_param(cfg, mac), self._get_param(cfg, ip)) for cfg in config]
+        current = self.static_hosts
+        if RouterError.hasError(current):
+            return current
+        settings = xmlobjects.StaticHostCollection()
+        settings.parseXML(current)
+        added, removed, changed = settings.sync(config)
+        if added or removed or changed:
+            response = self.call('lan.set_static_hosts', settings)
+            if RouterError.hasError(response):
+                return response
+        xml = xmlobjects.CustomXml({
+            'Added': [xmlobjects.CustomXml({'MacAddress': mac}) for mac in added],
+            'Removed': [xmlobjects.CustomXml({'MacAddress': mac}) for mac in removed],
+            'Changed': [xmlobjects.CustomXml({'MacAddress': mac}) for mac in changed]
+        })
+        return xml.buildXmlResponse()
 
     @post_api
     def clear_static_hosts(self):
         '''
         Remove all static host settings
         '''
-        return self.api('dhcp/static-addr-info', xmlobjects.StaticHostCollection())
+        return self.call('lan.set_static_hosts', xmlobjects.StaticHostCollection())
 
 
 class User(RouterObject):
     '''User module'''
-    @property
-    @get_api(cls='User', api='user/history-login')
-    def last_login(self): pass
+    last_login = endpoints.accessor('user.last_login')
 
 class Voip(RouterObject):
-    @property
-    @get_api(cls='Voip', api='voice/voicebusy')
-    def status(self): pass
-
-    @property
-    @get_api(cls='Voip', api='voice/voipadvance')
-    def voip_options(self):
-        '''
-        TODO: Untested
-        '''
-        pass
-
-    @property
-    @get_api(cls='Voip', api='voice/featureswitch')
-    def feature_switch(self): pass
-
-    @property
-    @get_api(cls='Voip', api='voice/sipaccount')
-    def sip_accounts(self): pass
+    status = endpoints.accessor('voip.status')
+    voip_options = endpoints.accessor('voip.voip_options')
+    feature_switch = endpoints.accessor('voip.feature_switch')
+    sip_accounts = endpoints.accessor('voip.sip_accounts')
 
     @post_api
     def remove_account(self, config):
@@ -234,7 +251,7 @@ class Voip(RouterObject):
         index = ele[0].find('.//index').text
         settings = xmlobjects.SipCollection()
         settings.account.append(xmlobjects.CustomXml({'index': index}, 'account'))
-        return self.enc_api('voice/deletesipaccount', settings)
+        return self.call('voip.remove_account', settings)
 
     @post_api
     def add_account(self, config):
@@ -243,15 +260,9 @@ class Voip(RouterObject):
         '''
         settings = xmlobjects.SipCollection()
         settings.addAccount(config)
-        return self.enc_api('voice/addipaccount', settings)
+        return self.call('voip.add_account', settings)
 
-    @property
-    @get_api(cls='Voip', api='voice/sipadvance')
-    def sip_options(self):
-        '''
-        Return current SIP options
-        '''
-        pass
+    sip_options = endpoints.accessor('voip.sip_options')
 
     @post_api
     def set_sip_options(self, config):
@@ -259,25 +270,21 @@ class Voip(RouterObject):
         Set SIP options: config -> { 'callwaiting': 0|1 }
         '''
         settings = xmlobjects.SipOptions(config)
-        return self.api('voice/sipadvanced', settings)
+        return self.call('voip.set_sip_options', settings)
 
-    @property
-    @get_api(cls='Voip', api='voice/sipserver')
-    def sipserver(self): pass
+    sipserver = endpoints.accessor('voip.sipserver')
 
     @post_api
     def set_sip_server(self, config):
         settings = xmlobjects.SipServer(config)
-        return self.api('voice/sipserver', settings)
+        return self.call('voip.set_sip_server', settings)
 
-    @property
-    @get_api(cls='Voip', api='voice/voice-basic-settings')
-    def voice_settings(self): pass
+    voice_settings = endpoints.accessor('voip.voice_settings')
 
     @post_api
     def set_voice_settings(self, config):
         settings = xmlobjects.VoiceSettings(config)
-        return self.api('voice/voice-basic-settings', settings)
+        return self.call('voip.set_voice_settings', settings)
 
 class Ethernet(RouterObject):
 
@@ -300,13 +307,8 @@ class Ethernet(RouterObject):
         5: 'Lan Only'
     }
 
-    @property
-    @get_api(cls='Ethernet', api='cradle/basic-info')
-    def settings(self): pass
-
-    @property
-    @get_api(cls='Ethernet', api='cradle/status-info')
-    def status(self): pass
+    settings = endpoints.accessor('ethernet.settings')
+    status = endpoints.accessor('ethernet.status')
 
     @property
     def connection(self):
@@ -335,10 +337,7 @@ class Ethernet(RouterObject):
         #Blank password
         conn_mode.pppoepwd = ''
         conn_mode.set(mode, config)
-        if not encrypt:
-            return self.api('cradle/basic-info', conn_mode)
-        else:
-            return self.enc_api('cradle/basic-info', conn_mode)
+        return self.call('ethernet.set_settings', conn_mode, encrypted=encrypt)
 
     @post_api
     def set_auto(self, config=False):
@@ -383,25 +382,11 @@ class Ethernet(RouterObject):
 
 class Device(RouterObject):
     '''Device module'''
-    @property
-    @get_api(cls='Device', api='device/information')
-    def info(self): pass
-
-    @property
-    @get_api(cls='Device', api='device/signal')
-    def signal(self): pass
-
-    @property
-    @get_api(cls='Device', api='monitoring/status')
-    def status(self): pass
-
-    @property
-    @get_api(cls='Device', api='led/circle-switch')
-    def circleled(self): pass
-
-    @property
-    @get_api(cls='Device', api='security/bridgemode')
-    def bridgemode(self): pass #Returns Not supported error on B525
+    info = endpoints.accessor('device.info')
+    signal = endpoints.accessor('device.signal')
+    status = endpoints.accessor('device.status')
+    circleled = endpoints.accessor('device.circleled')
+    bridgemode = endpoints.accessor('device.bridgemode')
 
     @property
     @post_api
@@ -419,26 +404,19 @@ class Device(RouterObject):
         '''Reboot the router'''
         control = xmlobjects.RouterControl.reboot()
         data = control.buildXML()
-        return self.api('device/control', data)
+        return self.call('device.control', data)
 
     @post_api
     def do_poweroff(self):
         '''Power off the router'''
         control = xmlobjects.RouterControl.poweroff()
         data = control.buildXML()
-        return self.api('device/control', data)
+        return self.call('device.control', data)
 
 class Network(RouterObject):
     '''Network module'''
-    @property
-    @get_api(cls='Network', api='net/net-mode')
-    def mode(self):
-        pass
-
-    @property
-    @get_api(cls='Network', api='net/net-mode-list')
-    def modelist(self):
-        pass
+    mode = endpoints.accessor('network.mode')
+    modelist = endpoints.accessor('network.modelist')
 
     @property
     @post_api
@@ -447,13 +425,13 @@ class Network(RouterObject):
         net.parseXML(self.mode)
 
         net_bands = []
-        for band in xmlobjects.NetworkMode.band_from_hex(net.NetworkBand):
+        for band in net.network_bands:
             if (band == 'EXTRA'):
                 continue
             net_bands.append(xmlobjects.CustomXml({'Band': band}))
 
         lte_bands = []
-        for band in xmlobjects.NetworkMode.lte_from_hex(net.LTEBand):
+        for band in net.lte_bands:
             lte_bands.append(xmlobjects.CustomXml({'Band': band}))
         xml = xmlobjects.CustomXml({
             'NetworkMode': xmlobjects.NetworkMode.get_mode(net.NetworkMode),
@@ -473,17 +451,16 @@ class Network(RouterObject):
         net = xmlobjects.NetworkMode()
         net.parseXML(self.mode)
         net.set_lte_band(bands)
-        return self.api('net/net-mode', net)
+        return self.call('network.set_mode', net)
     
     @post_api
     def set_network_band(self, config):
-        bands = self._get_param(config, 'bands')
         #Fuge to always add the extra unexplained values
-        bands.append('EXTRA')
+        bands = list(self._get_param(config, 'bands')) + ['EXTRA']
         net = xmlobjects.NetworkMode()
         net.parseXML(self.mode)
         net.set_network_band(bands)
-        return self.api('net/net-mode', net)
+        return self.call('network.set_mode', net)
 
     @post_api
     def set_network_mode(self, config):
@@ -491,18 +468,50 @@ class Network(RouterObject):
         net = xmlobjects.NetworkMode()
         net.parseXML(self.mode)
         net.set_network_mode(mode)
-        return self.api('net/net-mode', net)
+        return self.call('network.set_mode', net)
+
+    @post_api
+    def sweep_lte_bands(self, config):
+        '''
+        Measures each LTE band combination and locks the router to the best one
+        {'candidates': [['B1', 'B3'], ['B3'], ['B7', 'B28']], 'samples': 3, 'apply': True}
+        Optional: min_samples (default 2, or samples if fewer), settle_time and sample_interval in seconds
+        Returns the results, best first
+        <Best><Band>B3</Band></Best><Results><Result><Bands>..</Bands><Score>..</Score>..</Result></Results>
+        '''
+        candidates = self._get_param(config, 'candidates')
+        samples = self._get_param(config, 'samples', 3)
+        sweep = BandSweep(self.router, candidates,
+            samples=samples,
+            min_samples=self._get_param(config, 'min_samples', min(2, samples)),
+            sample_interval=self._get_param(config, 'sample_interval', 2),
+            settle_time=self._get_param(config, 'settle_time', 5),
+            apply_best=self._get_param(config, 'apply', True))
+        results = sweep.run()
+        def bands(result):
+            return [xmlobjects.CustomXml({'Band': band}) for band in result.bands]
+        def value(result, metric):
+            mean = result.mean(metric)
+            return '' if mean is None else '%.1f' % mean
+        xml = xmlobjects.CustomXml({
+            'Best': bands(sweep.best) if sweep.best is not None else '',
+            'Results': [xmlobjects.CustomXml({'Result': [xmlobjects.CustomXml({
+                'Bands': bands(result),
+                'Score': '' if result.score is None else '%.1f' % result.score,
+                'Rsrp': value(result, 'rsrp'),
+                'Sinr': value(result, 'sinr'),
+                'Download': value(result, 'download'),
+                'Samples': len(result.samples),
+                'Dominated': int(result.dominated),
+                'Error': escape(result.error or '')
+            })]}) for result in results]
+        })
+        return xml.buildXmlResponse()
 
 class Security(RouterObject):
     '''Security module'''
-    @property
-    @get_api(cls='Security', api='security/mac-filter')
-    def macfilter(self):
-        pass
-
-    @get_api(cls='Security', api='timerule/timerule')
-    def timerule(self):
-        pass
+    macfilter = endpoints.accessor('security.macfilter')
+    timerule = endpoints.accessor('security.timerule', call=True)
 
     @post_api
     def deny_macaddress(self, macs):
@@ -512,7 +521,7 @@ class Security(RouterObject):
         for mac in macs:
             fltr.addMac(xmlobjects.MacFilter(mac))
         data = fltr.buildXML()
-        return self.api('security/mac-filter', data)
+        return self.call('security.set_macfilter', data)
 
     @post_api
     def allow_macaddress(self, macs):
@@ -522,7 +531,7 @@ class Security(RouterObject):
         for mac in macs:
             fltr.addMac(xmlobjects.MacFilter(mac))
         data = fltr.buildXML()
-        return self.api('security/mac-filter', data)
+        return self.call('security.set_macfilter', data)
 
     @post_api
     def set_macfilter_off(self):
@@ -535,25 +544,10 @@ class Security(RouterObject):
 
 class Monitoring(RouterObject):
     '''Monitoring module'''
-    @property
-    @get_api(cls='Monitoring', api='monitoring/traffic-statistics')
-    def traffic(self):
-        pass
-
-    @property
-    @get_api(cls='Monitoring', api='monitoring/month_statistics')
-    def stats(self):
-        pass
-
-    @property
-    @get_api(cls='Monitoring', api='monitoring/check-notifications')
-    def notifications(self):
-        pass
-
-    @property
-    @get_api(cls='Monitoring', api='monitoring/start_date')
-    def trafficalert(self):
-        pass
+    traffic = endpoints.accessor('monitoring.traffic')
+    stats = endpoints.accessor('monitoring.stats')
+    notifications = endpoints.accessor('monitoring.notifications')
+    trafficalert = endpoints.accessor('monitoring.trafficalert')
 
     @post_api
     def clear_stats(self):
@@ -563,7 +557,7 @@ class Monitoring(RouterObject):
         of the monthly statistics. For example StartDay=1, on 1st of month at 00:00 the
         monthly statistics will be reset.
         '''
-        return self.api('monitoring/clear-traffic', {'ClearTraffic': 1})
+        return self.call('monitoring.clear_traffic', {'ClearTraffic': 1})
 
     @post_api
     def set_trafficalert(self, config):
@@ -577,8 +571,8 @@ class Monitoring(RouterObject):
         startday = self._get_param(config, 'startday', 1)
         datalimit = self._get_param(config, 'datalimit', '0GB')
         threshold = self._get_param(config, 'threshold', 0)
-        return self.api(
-            'monitoring/start_date',
+        return self.call(
+            'monitoring.set_trafficalert',
             {
                 'StartDay': startday,
                 'DataLimit': datalimit,
@@ -587,11 +581,105 @@ class Monitoring(RouterObject):
                 'SetMonthData': 1
             })
 
+class Sms(RouterObject):
+    '''SMS module, messages are read a page at a time'''
+    count = endpoints.accessor('sms.count')
+
+    INBOX = 1
+    OUTBOX = 2
+    #The most messages the router returns in a page
+    PAGE_SIZE = 50
+
+    def __page(self, page, size, box, unread_first):
+        response = self.call('sms.list', xmlobjects.SmsListRequest(page, size, box, unread_first))
+        if RouterError.hasError(response):
+            raise RouterError.fromResponse(response)
+        messages = xmlobjects.SmsCollection()
+        messages.parseXML(response)
+        return messages
+
+    @classmethod
+    def __more(cls, messages, size):
+        #sms-list Count is the number of messages in the page, so only a short page shows the end
+        return len(messages.Messages) == size
+
+    def iter_messages(self, box=INBOX, page_size=PAGE_SIZE, unread_first=False):
+        '''
+        Yields an SmsMessage for each message in box. Only one page is held at a time,
+        and the next page is read while the current one is processed. Errors raise RouterError.
+        Deleting messages moves later ones to earlier pages, use drain to delete as you go
+        '''
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = 1
+            pending = executor.submit(contextvars.copy_context().run, self.__page, page, page_size, box, unread_first)
+            while pending is not None:
+                messages = pending.result()
+                pending = None
+                if self.__more(messages, page_size):
+                    page += 1
+                    pending = executor.submit(contextvars.copy_context().run, self.__page, page, page_size, box, unread_first)
+                yield from messages.Messages
+
+    async def aiter_messages(self, box=INBOX, page_size=PAGE_SIZE, unread_first=False, executor=None):
+        '''As iter_messages, for async for, the requests are made on executor'''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        page = 1
+        #Copied so the caller's scheduler priority applies to each request
+        pending = loop.run_in_executor(executor, contextvars.copy_context().run, self.__page, page, page_size, box, unread_first)
+        while pending is not None:
+            messages = await pending
+            pending = None
+            if self.__more(messages, page_size):
+                page += 1
+                pending = loop.run_in_executor(executor, contextvars.copy_context().run, self.__page, page, page_size, box, unread_first)
+            for message in messages.Messages:
+                yield message
+
+    def drain(self, box=INBOX, page_size=PAGE_SIZE):
+        '''
+        Yields every message in box, deleting each page in one request once its messages have been processed.
+        A page is not deleted if processing one of its messages raised. Errors raise RouterError
+        '''
+        while True:
+            messages = self.__page(1, page_size, box, False)
+            yield from messages.Messages
+            if not messages.Messages:
+                return
+            response = self.delete(messages.Messages)
+            if RouterError.hasError(response):
+                raise RouterError.fromResponse(response)
+            if len(messages.Messages) < page_size:
+                return
+
+    @post_api
+    def delete(self, messages, batch=PAGE_SIZE):
+        '''Deletes messages, SmsMessages or their Index values, sending batch of them per request'''
+        return self.__batched('sms.delete', messages, batch)
+
+    @post_api
+    def mark_read(self, messages, batch=PAGE_SIZE):
+        '''Marks messages as read, SmsMessages or their Index values, sending batch of them per request'''
+        return self.__batched('sms.set_read', messages, batch)
+
+    def __batched(self, name, messages, batch):
+        indexes = [getattr(message, 'Index', message) for message in messages]
+        if not indexes:
+            raise ValueError('No messages specified')
+        for start in range(0, len(indexes), batch):
+            response = self.call(name, xmlobjects.SmsIndexes(indexes[start:start + batch]))
+            if RouterError.hasError(response):
+                break
+        return response
+
 class Wan(RouterObject):
     '''WAN module'''
-    @property
-    @get_api(cls='Wan', api='security/virtual-servers')
-    def port_forwards(self): pass
+    port_forwards = endpoints.accessor('wan.port_forwards')
+
+    def iter_port_forwards(self):
+        '''Yields a VirtualServer for each port forward as it arrives, errors raise RouterError'''
+        servers = xmlobjects.VirtualServerCollection()
+        return (servers.child('Servers', xml) for xml in self.router.iter_api('security/virtual-servers', 'Servers'))
 
     @post_api
     def add_port_forward(self, config):
@@ -601,11 +689,11 @@ class Wan(RouterObject):
             config = [config]
         for cfg in config:
             settings.add_service(cfg)
-        return self.api('security/virtual-servers', settings)
+        return self.call('wan.set_port_forwards', settings)
     
     @post_api
     def clear_port_forwards(self):
-        return self.api('security/virtual-servers', {'Servers': ''})
+        return self.call('wan.set_port_forwards', {'Servers': ''})
 
     @post_api
     def remove_port_forward(self, config):
@@ -616,18 +704,41 @@ class Wan(RouterObject):
         for cfg in config:
             name = self._get_param(cfg, 'name')
             settings.remove_service(name)
-        return self.api('security/virtual-servers', settings)
+        return self.call('wan.set_port_forwards', settings)
 
-    @property
-    @get_api(cls='Wan', api='ddns/ddns-list')
-    def ddns(self): pass
+    @post_api
+    def sync_port_forwards(self, config):
+        '''
+        Makes the port forwards match config, a list of add_port_forward settings matched by name.
+        The table is read once and written once, and only if something changed.
+        Returns the names of the added, removed and changed port forwards
+        <Added><Name>xxx</Name></Added><Removed /><Changed />
+        '''
+        current = self.port_forwards
+        if RouterError.hasError(current):
+            return current
+        settings = xmlobjects.VirtualServerCollection()
+        settings.parseXML(current)
+        added, removed, changed = settings.sync(config)
+        if added or removed or changed:
+            response = self.call('wan.set_port_forwards', settings)
+            if RouterError.hasError(response):
+                return response
+        xml = xmlobjects.CustomXml({
+            'Added': [xmlobjects.CustomXml({'Name': name}) for name in added],
+            'Removed': [xmlobjects.CustomXml({'Name': name}) for name in removed],
+            'Changed': [xmlobjects.CustomXml({'Name': name}) for name in changed]
+        })
+        return xml.buildXmlResponse()
+
+    ddns = endpoints.accessor('wan.ddns')
 
     @post_api
     def add_ddns(self, config):
         settings = xmlobjects.DdnsCollection()
         settings.addDdns(config)
         settings.setToAdd()
-        return self.enc_api('ddns/ddns-list', settings)
+        return self.call('wan.set_ddns', settings)
 
     @post_api
     def edit_ddns(self, config):
@@ -639,7 +750,7 @@ class Wan(RouterObject):
         if ele is None:
             raise ValueError('Unable to find domain: %s' % ddns.domainname)
         ddns.index = ele[0].find('.//index').text
-        return self.enc_api('ddns/ddns-list', settings)
+        return self.call('wan.set_ddns', settings)
 
     @post_api
     def remove_ddns(self, config):
@@ -652,22 +763,48 @@ class Wan(RouterObject):
         settings = xmlobjects.DdnsCollection()
         settings.setToDelete()
         settings.ddnss.append(xmlobjects.CustomXml({'index': index}, 'ddns'))
-        return self.enc_api('ddns/ddns-list', settings)
+        return self.call('wan.set_ddns', settings)
 
 class B525Router(object):
     '''B525 implementation'''
     REQUEST_TOKEN = '__RequestVerificationToken'
 
-    def __init__(self, host):
+    #(connect, read) timeouts in seconds
+    DEFAULT_TIMEOUT = (3.05, 15)
+
+    def __init__(self, host, timeout=DEFAULT_TIMEOUT, breaker=None, transport=None, session_store=None, raise_errors=False,
+                 scheduler=None):
+        '''
+        timeout: (connect, read) timeouts in seconds, or a single value for both
+        breaker: CircuitBreaker used to fail fast when the router is unreachable
+        transport: Transport providing the connection pool, share one to pool connections across routers
+        session_store: SessionStore used to resume a previous process's login
+        raise_errors: raise RouterError subclasses instead of returning XML errors
+        scheduler: RequestScheduler ordering api requests by priority, with a limit on concurrent requests
+        '''
         self.client = None
         self.router = host
+        self.timeout = timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.transport = transport
+        self.session_store = session_store
+        self.raise_errors = raise_errors
+        self.scheduler = scheduler
 
         self.username = None
         self.__password = None
-        self.__rsae = None
-        self.__rsan = None
+        #Session state is replaced as a whole so it can be read without locking
+        self.__rsa = (None, None)
         self.__is_logged_in = False
-        self.__lock = threading.Lock()
+        self.__last_login = 0
+        self.__timeout = 300
+        self.__token = None
+        #True until a resumed session has been accepted by the router
+        self.__resumed = False
+        #Held while logging in, re-entrant so logout can call api
+        self.__lock = threading.RLock()
+        #Held from fetching a one-time token until the POST using it completes
+        self.__write_lock = threading.Lock()
 
         self.device = Device(self)
         self.lan = Lan(self)
@@ -679,19 +816,58 @@ class B525Router(object):
         self.net = Network(self)
         self.ethernet = Ethernet(self)
         self.voip = Voip(self)
+        self.sms = Sms(self)
 
     def login(self, username, password, keepalive=300):
+        unavailable = self.__check_circuit()
+        if unavailable is not None:
+            raise RouterError.fromResponse(unavailable)
         with self.__lock:
-            self.__last_login=datetime.now()-timedelta(seconds=keepalive)
             self.username = username
             self.__password = password
             self.__timeout = keepalive
+            if self.__resume():
+                return
             return self.__login()
 
+    def __resume(self):
+        '''Restores a saved session, returns False if there is none to use'''
+        if self.session_store is None:
+            return False
+        session = self.session_store.load(self.router, self.username, self.__timeout)
+        if session is None:
+            return False
+        logger.info('RESUME session for user [%s]' % self.username)
+        self.__ensure_client()
+        for cookie in session['cookies']:
+            self.client.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+        self.__rsa = (session['rsae'], session['rsan'])
+        self.__token = None
+        self.__last_login = monotonic() - max(time.time() - session['login_time'], 0)
+        self.__resumed = True
+        self.__is_logged_in = True
+        return True
+
+    def __save_session(self):
+        if self.session_store is None:
+            return
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path} for c in self.client.cookies]
+        rsae, rsan = self.__rsa
+        self.session_store.save(self.router, self.username, cookies, rsae, rsan, time.time())
+
+    def __ensure_client(self):
+        if self.client is not None:
+            return
+        with self.__lock:
+            if self.transport is None:
+                from huawei_lte.transport import Transport
+                self.transport = Transport()
+            if self.client is None:
+                self.client = self.transport.session()
+
     def __setup_session(self):
         """ gets the url from the server ignoring the response, just to get session cookie set up """
-        if self.client is None:
-            self.client = requests.Session()
+        self.__ensure_client()
         url = "http://%s/" % self.router
         response = self.__get(url)
         response.raise_for_status()
@@ -699,12 +875,36 @@ class B525Router(object):
         # a buffering exception on one of the machines
         sleep(1)
 
+    def __check_circuit(self):
+        '''
+        Returns an error response if the router is known to be unreachable, otherwise None.
+        Once the breaker's reset timeout has elapsed the cheap token endpoint is used to probe the router.
+        '''
+        state = self.breaker.before_call()
+        if state == CircuitBreaker.CLOSED:
+            return None
+        if state == CircuitBreaker.HALF_OPEN and self.__probe():
+            return None
+        return xmlobjects.Error.xml_unavailable(self.router)
+
+    def __probe(self):
+        self.__ensure_client()
+        url = "http://%s/api/webserver/token" % self.router
+        try:
+            self.__get(url)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
     def __get_server_token(self):
         """ retrieves server token """
         url = "http://%s/api/webserver/token" % self.router
+        start = instrument.clock()
         token_response = self.__get(url).text
+        if start is not None:
+            instrument.record('token', start, code=instrument.error_code(token_response))
         if RouterError.hasError(token_response):
-            raise RouterError(token_response)
+            raise RouterError.fromResponse(token_response)
         root = ET.fromstring(token_response)
         return root.findall('./token')[0].text
 
@@ -721,12 +921,13 @@ class B525Router(object):
         headers = {'Content-type': 'text/html', self.REQUEST_TOKEN: token[32:]}
         response = self.__post(url=url, data=xml, headers=headers)
         if RouterError.hasError(response.text):
-            raise RouterError(response.text)
+            raise RouterError.fromResponse(response.text)
         return response
 
     def __login(self):
         """ logs in to the router using SCRAM method of authentication """
         logger.info('LOGIN for user [%s]' % self.username)
+        start = instrument.clock()
         response = self.__api_challenge()
         verification_token = response.headers[self.REQUEST_TOKEN]
         scram_data = ET.fromstring(response.text)
@@ -742,9 +943,8 @@ class B525Router(object):
         url = "http://%s/api/user/authentication_login" % self.router
         result = self.__post(url=url, data=login_request, headers=headers)
         if RouterError.hasError(result.text):
-            raise RouterError(result.text)
+            raise RouterError.fromResponse(result.text)
         verification_token = result.headers[self.REQUEST_TOKEN]
-        self.__last_login = datetime.now()
         '''
         The SCRAM protocol would normally validate the server signatures
         We're assuming this is ok
@@ -755,59 +955,153 @@ class B525Router(object):
         if (ret.response.rsapubkeysignature == publicKeySignature) {
         '''
         xml = ET.fromstring(result.text)
-        self.__rsae = xml.find('.//rsae').text
-        self.__rsan = xml.find('.//rsan').text
+        self.__rsa = (xml.find('.//rsae').text, xml.find('.//rsan').text)
+        self.__token = None
+        self.__last_login = monotonic()
+        self.__resumed = False
         self.__is_logged_in = True
+        self.__save_session()
+        if start is not None:
+            instrument.record('login', start)
+
+    def __relogin(self, seen_login):
+        '''Logs in again, unless another thread already did so since seen_login'''
+        with self.__lock:
+            if self.__is_logged_in and self.__last_login == seen_login:
+                start = instrument.clock()
+                self.__login()
+                if start is not None:
+                    instrument.record('relogin', start)
+
+    def __check_session(self):
+        '''Login again if the session has timed out'''
+        last_login = self.__last_login
+        if self.__is_logged_in and monotonic() - last_login >= self.__timeout:
+            logger.debug('Session timeout - establishing new login...')
+            self.__relogin(last_login)
+
+    def __read_token(self):
+        '''
+        Returns a verification token for GET requests.
+        GET requests do not use up the token so it is cached, POST requests clear the cache
+        '''
+        token = self.__token
+        if token is None:
+            token = self.__get_server_token()[32:]
+            self.__token = token
+        return token
 
     def enc_api(self, url, data):
         return self.api(url=url, data=data, encrypted=True)
 
+    def __send(self, method, url, **kwargs):
+        '''Sends the request with explicit timeouts, recording connection failures against the circuit breaker'''
+        start = instrument.clock()
+        try:
+            result = method(url, timeout=self.timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        #A streamed body has not been read yet, so it is not traced or counted
+        streamed = kwargs.get('stream', False)
+        if not streamed and wiretrace.logger.isEnabledFor(logging.DEBUG):
+            wiretrace.trace(method.__name__, url, kwargs.get('headers'), kwargs.get('data'), result)
+        if start is not None:
+            instrument.record('http.' + method.__name__, start, url=url, status=result.status_code,
+                bytes=None if streamed else len(result.content), bytes_sent=len(kwargs.get('data') or ''))
+        return result
+
+    #Requests and responses are traced by the huawei_lte.wire logger, see wiretrace
     def __post(self, url, data, headers):
-        logger.debug('------------ REQUEST to %s -------------', url)
-        logger.debug('-- HEADERS --')
-        logger.debug('%s', headers)
-        logger.debug('-------------')
-        logger.debug('-- DATA --')
-        logger.debug('%s', data)
-        logger.debug('-------------')
-        result = self.client.post(url, data=data, headers=headers)
-        logger.info('POST %s %i' % (url, result.status_code))
-        logger.debug('------------ RESPONSE to %s -------------', url)
-        logger.debug('-- HEADERS --')
-        logger.debug('%s', result.headers)
-        logger.debug('-------------')
-        logger.debug('-- DATA --')
-        logger.debug('%s', result.text)
-        logger.debug('-------------')
+        result = self.__send(self.client.post, url, data=data, headers=headers)
+        logger.info('POST %s %i', url, result.status_code)
         return result
 
     def __get(self, url, headers=None):
-        logger.debug('------------ REQUEST to %s -------------', url)
-        logger.debug('-- HEADERS --')
-        logger.debug('%s', headers)
-        logger.debug('-------------')
-        result = self.client.get(url, headers=headers)
-        logger.info('GET %s %i' % (url, result.status_code))
-        logger.debug('------------ RESPONSE to %s -------------', url)
-        logger.debug('-- HEADERS --')
-        logger.debug('%s', result.headers)
-        logger.debug('-------------')
-        logger.debug('-- DATA --')
-        logger.debug('%s', result.text)
-        logger.debug('-------------')
+        result = self.__send(self.client.get, url, headers=headers)
+        logger.info('GET %s %i', url, result.status_code)
         return result
         
+    def __request(self, url, data, encrypted):
+        headers = {}
+        if (encrypted):
+            headers['Content-type'] = 'application/x-www-form-urlencoded; charset=UTF-8;enc'
+        else:
+            headers['Content-type'] = 'application/x-www-form-urlencoded; charset=UTF-8'
+
+        if data is None or data == '':
+            headers[self.REQUEST_TOKEN] = self.__read_token()
+            return self.__decode(self.__get(url, headers))
+
+        if encrypted:
+            rsae, rsan = self.__rsa
+            start = instrument.clock()
+            data = crypto.rsa_encrypt(rsae, rsan, data)
+            if start is not None:
+                instrument.record('encrypt', start, bytes=len(data))
+        with self.__write_lock:
+            headers[self.REQUEST_TOKEN] = self.__get_server_token()[32:]
+            try:
+                return self.__decode(self.__post(url, data, headers))
+            finally:
+                self.__token = None
+
+    @classmethod
+    def __decode(cls, response):
+        start = instrument.clock()
+        text = response.text
+        if start is not None:
+            instrument.record('decode', start, bytes=len(response.content))
+        return text
+
+    @post_api
+    def call(self, name, data=None, encrypted=None):
+        '''
+        Calls an endpoint by name, e.g. call('device.signal') or call('device.control', {'Control': 1})
+        The path, method and encryption come from huawei_lte.endpoints, encrypted overrides the endpoint's setting
+        '''
+        endpoint = endpoints.lookup(name)
+        if endpoint.method == endpoints.GET:
+            return self.api(endpoint.path)
+        if data is None:
+            raise ValueError('Endpoint [%s] requires data' % name)
+        return self.api(endpoint.path, data, endpoint.encrypted if encrypted is None else encrypted)
+
+    async def acall(self, name, data=None, encrypted=None, executor=None):
+        '''Awaitable call, run on executor (the event loop's default if None)'''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        #Copied so the caller's scheduler priority applies to the request
+        return await loop.run_in_executor(executor, contextvars.copy_context().run, self.call, name, data, encrypted)
+
     @post_api
     def api(self, url, data=None, encrypted=False):
-        """ Handles all api calls to the router """
+        """ Handles all api calls to the router, safe to call from multiple threads """
+        start = instrument.clock()
+        if start is None:
+            return self.__api(url, data, encrypted)
+        response = None
+        code = xmlobjects.Error.PYTHON_API_ERROR_CODE
+        try:
+            response = self.__api(url, data, encrypted)
+            code = instrument.error_code(response)
+            return response
+        except RouterError as err:
+            code = int(err.code)
+            raise
+        finally:
+            instrument.record('api', start, url=url, bytes=len(response or ''), code=code)
+
+    def __api(self, url, data, encrypted):
+        #Fail fast if the router is known to be unreachable
+        unavailable = self.__check_circuit()
+        if unavailable is not None:
+            raise RouterError.fromResponse(unavailable)
+
         #Check if the session has timed out, and login again if it has
-        timed_out = datetime.now() - self.__last_login
-        if (timed_out.total_seconds() >= self.__timeout and self.__is_logged_in):
-            with self.__lock:
-                if (timed_out.total_seconds() >= self.__timeout and self.__is_logged_in):
-                    logger.debug('Session timeout - establishing new login...')
-                    self.__login()
-        verification_token = self.__get_server_token()[32:]
+        self.__check_session()
+        last_login = self.__last_login
 
         if isinstance(data, dict):
             data = xmlobjects.CustomXml(data).buildXML()
@@ -815,70 +1109,213 @@ class B525Router(object):
             data = data.buildXML()
 
         url = "http://%s/api/%s" % (self.router, url)
-        headers = {}
-        headers[self.REQUEST_TOKEN] = verification_token
-        if (encrypted):
-            headers['Content-type'] = 'application/x-www-form-urlencoded; charset=UTF-8;enc'
-        else:
-            headers['Content-type'] = 'application/x-www-form-urlencoded; charset=UTF-8'
-
-        #print(data)
-
-        if data is None or data == '':
-            response = self.__get(url, headers).text
+        #Writes go before reads unless the caller set a priority
+        default = scheduler.INTERACTIVE if data else scheduler.NORMAL
+        return self.__scheduled(default, self.__api_request, url, data, encrypted, last_login)
+
+    def __scheduled(self, default, f, *args):
+        '''Calls f in a scheduler slot at the caller's priority, or default'''
+        if self.scheduler is None:
+            return f(*args)
+        if not self.scheduler.acquire(scheduler.current_priority(default)):
+            raise RouterError.fromCode(xmlobjects.Error.REQUEST_DROPPED_ERROR_CODE)
+        try:
+            return f(*args)
+        finally:
+            self.scheduler.release()
+
+    def __api_request(self, url, data, encrypted, last_login):
+        response = self.__request(url, data, encrypted)
+
+        if not RouterError.hasError(response):
+            self.__resumed = False
+            return response
+        #Parsed once, the typed error is raised or rebuilt with its message by post_api
+        error = RouterError.fromResponse(response)
+        if error.code == '125003':
+            #The token was used up by a concurrent request
+            logger.debug('Invalid session token - retrying with a new token...')
+            self.__token = None
+            response = self.__request(url, data, encrypted)
+        elif self.__is_logged_in and (error.code == '125002' or (self.__resumed and error.code == '100003')):
+            #A resumed session may have been ended by the router
+            logger.debug('Invalid session - establishing new login...')
+            self.__relogin(last_login)
+            response = self.__request(url, data, encrypted)
         else:
-            if encrypted:
-                data = crypto.rsa_encrypt(self.__rsae, self.__rsan, data)
-            response = self.__post(url, data, headers).text    
-
-        #print(response)
+            raise error
 
-        #Add error message if known and missing
         if RouterError.hasError(response):
-            error = xmlobjects.Error()
-            error.parseXML(response)
-            response = error.buildXmlError()
+            raise RouterError.fromResponse(response)
         return response
 
+    def iter_api(self, url, list_tag, chunk_size=4096):
+        '''
+        Streams a GET api response, yielding the XML of each entry in list_tag as soon as it arrives
+        e.g. for host in router.iter_api('lan/HostInfo', 'Hosts'): ...
+        Raises RouterError if the router returns an error
+        '''
+        unavailable = self.__check_circuit()
+        if unavailable is not None:
+            raise RouterError.fromResponse(unavailable)
+        self.__check_session()
+        last_login = self.__last_login
+        url = "http://%s/api/%s" % (self.router, url)
+        try:
+            #Errors are the whole response, so nothing has been yielded if one is raised
+            yield from self.__stream(url, list_tag, chunk_size)
+        except RouterError as err:
+            if err.code == '125003':
+                self.__token = None
+            elif self.__is_logged_in and (err.code == '125002' or (self.__resumed and err.code == '100003')):
+                logger.debug('Invalid session - establishing new login...')
+                self.__relogin(last_login)
+            else:
+                raise
+            yield from self.__stream(url, list_tag, chunk_size)
+
+    def __stream(self, url, list_tag, chunk_size):
+        #Only sending takes a scheduler slot, so the caller can make requests while working through the entries
+        with self.__scheduled(scheduler.NORMAL, self.__open_stream, url) as response:
+            logger.info('GET %s %i', url, response.status_code)
+            yield from xmlobjects.iterparse_items(response.iter_content(chunk_size), list_tag)
+        self.__resumed = False
+
+    def __open_stream(self, url):
+        headers = {
+            'Content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            self.REQUEST_TOKEN: self.__read_token()}
+        return self.__send(self.client.get, url, headers=headers, stream=True)
 
     @property
     def features(self):
         ''' Tests the routers available features'''
         result = xmlobjects.TestFunctions()
-        info = self.device.info
+        info = self.__read_or_error('device.info')
         if (not RouterError.hasError(info)):
             result.parseXML(info)
 
-        objs = [self]
-
-        for value in vars(self).values():
-            if issubclass(type(value), RouterObject):
-                objs.append(value)
-
-        #Iterate through get_api calls
-        for val in GET_APIS:
-            cls = val[0]
-            f = val[1]
-            api = val[2]
-            func = None
-            #find function
-            for ob in objs:
-                if ob.__class__.__name__ == cls and hasattr(ob,f):
-                    if isinstance(getattr(type(ob), f, None), property):
-                        prop = getattr(type(ob), f, None)
-                        result.addFunction(ob, f, api, prop.__get__(ob, type(ob)))
-                    else:
-                        func = getattr(ob, f)
-                        result.addFunction(ob, f, api, func())
-            
+        for endpoint in endpoints.probes():
+            result.addFunction(endpoint.module, endpoint.attr, endpoint.path, self.__read_or_error(endpoint.name))
+
         return result.buildXmlResponse()
 
+    #The endpoints read by health checks
+    SNAPSHOT = ('device.info', 'device.signal', 'device.status', 'monitoring.traffic', 'monitoring.stats', 'lan.clients', 'ethernet.status')
+
+    @post_api
+    def snapshot(self, names=SNAPSHOT, parsed=False, max_workers=8):
+        '''
+        Reads GET endpoints concurrently, taking about as long as the slowest one.
+        Returns <response><part name="device.info"><response>...</response></part>...</response>
+        where a part that failed holds its <error>, or if parsed a dictionary of
+        endpoint name -> ElementTree root, or RouterError for a part that failed
+        '''
+        names = list(names)
+        for name in names:
+            if endpoints.lookup(name).method != endpoints.GET:
+                raise ValueError('Snapshot endpoints must be GET endpoints [%s]' % name)
+        #Log in and read the token once, before the requests share the session and its token
+        self.__check_session()
+        self.__warm_token()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names)))) as executor:
+            #Copied so the caller's scheduler priority applies to each request
+            futures = [executor.submit(contextvars.copy_context().run, self.__read_or_error, name) for name in names]
+            responses = [future.result() for future in futures]
+        if parsed:
+            return dict((name, RouterError.fromResponse(response) if RouterError.hasError(response) else ET.fromstring(response))
+                        for name, response in zip(names, responses))
+        #Each part's XML declaration is dropped so that its root can be nested
+        parts = ''.join('<part name="%s">%s</part>' % (name, response.split('?>', 1)[1] if response.startswith('<?xml') else response)
+                        for name, response in zip(names, responses))
+        return '<?xml version="1.0" encoding="UTF-8"?><response>%s</response>' % parts
+
+    def __warm_token(self):
+        '''Caches the token, so concurrent GET requests do not each read one'''
+        if self.__check_circuit() is not None:
+            return
+        try:
+            self.__ensure_client()
+            self.__read_token()
+        except (RouterError, requests.exceptions.RequestException) as err:
+            #Each request reports the error
+            logger.debug('Reading the token from %s failed: %s', self.router, err)
+
+    def __read_or_error(self, name):
+        '''Returns the response, or the XML error even when raise_errors is set'''
+        try:
+            return self.call(name)
+        except RouterError as err:
+            return err.buildXmlError()
+
     @post_api
     def logout(self):
         '''Logout user'''
+        logger.info('LOGOUT for user [%s]', self.username)
+        #Not under the lock, the call may wait for a scheduler slot held by a request that logs in again
+        response = self.call('user.logout', {'Logout': 1})
+        if RouterError.hasError(response):
+            raise RouterError.fromResponse(response)
         with self.__lock:
-            logger.info('LOGOUT for user [%s]', self.username)
-            response = self.api('user/logout', {'Logout': 1})
-            if RouterError.hasError(response):
-                raise RouterError(response)
             self.__is_logged_in = False
+            self.__token = None
+            if self.session_store is not None:
+                self.session_store.remove(self.router, self.username)
+
+    def __ping(self, timeout):
+        '''Returns True if the router's web server answers on the cheap token endpoint'''
+        self.__ensure_client()
+        url = "http://%s/api/webserver/token" % self.router
+        try:
+            return self.client.get(url, timeout=timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def wait_until_down(self, timeout=60, interval=1):
+        '''Polls the router until it stops responding, returns False if it is still up after timeout seconds'''
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if not self.__ping(interval):
+                logger.info('Router %s is down', self.router)
+                return True
+            sleep(interval)
+        return False
+
+    @post_api
+    def wait_until_ready(self, timeout=300, interval=2, max_interval=15):
+        '''
+        Polls the router with backoff until it is serving requests again.
+        The token endpoint is checked first, then the session is re-established and device/information is read.
+        Returns the device information response, or an error response on timeout
+        '''
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            if self.__ping(min(interval, max(deadline - monotonic(), 0.1))):
+                try:
+                    if self.username is not None:
+                        with self.__lock:
+                            self.__login()
+                    self.breaker.reset()
+                    info = self.device.info
+                    if not RouterError.hasError(info):
+                        logger.info('Router %s is ready', self.router)
+                        return info
+                    logger.debug('Router %s is not ready: %s', self.router, info)
+                except (RouterError, requests.exceptions.RequestException) as err:
+                    logger.debug('Router %s is not ready: %s', self.router, err)
+            sleep(max(min(interval, deadline - monotonic()), 0))
+            interval = min(interval * 2, max_interval)
+        raise ValueError('Router %s was not ready within %s seconds' % (self.router, timeout))
+
+    @post_api
+    def reboot(self, down_timeout=60, ready_timeout=300):
+        '''
+        Reboots the router and waits until it is serving requests again.
+        Returns the device information once the router is back, or an error response
+        '''
+        response = self.device.do_reboot()
+        if RouterError.hasError(response):
+            return response
+        if not self.wait_until_down(down_timeout):
+            raise ValueError('Router %s did not go down within %s seconds of the reboot request' % (self.router, down_timeout))
+        return self.wait_until_ready(ready_timeout)
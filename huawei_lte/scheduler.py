@@ -0,0 +1,90 @@
+""" Orders a router's API requests by priority, with a limit on how many are sent to it at once
+
+    import huawei_lte.scheduler as scheduler
+    router = B525Router('192.168.8.1', scheduler=scheduler.RequestScheduler(max_concurrent=2, max_poll_wait=10))
+    with scheduler.priority(scheduler.POLL):
+        router.device.signal
+
+Requests sending data default to INTERACTIVE and reads to NORMAL, monitoring code marks its reads as POLL.
+When the router is busy the waiting request with the highest priority goes next, so writes are not queued
+behind a backlog of polls. A POLL waiting longer than max_poll_wait is dropped with error 2002, its
+result would be stale and the next poll replaces it.
+"""
+import heapq
+import itertools
+import threading
+import contextvars
+from time import monotonic
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+NORMAL = 1
+POLL = 2
+
+#Set per thread or asyncio task, so it follows the caller rather than the router
+_priority = contextvars.ContextVar('huawei_lte_priority', default=None)
+
+@contextmanager
+def priority(level):
+    '''Sends the router requests made in the block at level'''
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority(default):
+    '''Returns the level set by priority, or default'''
+    level = _priority.get()
+    return default if level is None else level
+
+class RequestScheduler(object):
+    '''
+    max_concurrent: requests sent to the router at once, its web server handles few at a time
+    max_poll_wait: seconds a POLL request can wait before it is dropped, None to never drop
+    '''
+    def __init__(self, max_concurrent=2, max_poll_wait=10):
+        if max_concurrent < 1:
+            raise ValueError('max_concurrent must be at least 1')
+        self.max_concurrent = max_concurrent
+        self.max_poll_wait = max_poll_wait
+        self.dropped = 0
+        self.__active = 0
+        self.__waiting = []
+        self.__order = itertools.count()
+        self.__cond = threading.Condition()
+
+    @property
+    def waiting(self):
+        return len(self.__waiting)
+
+    def acquire(self, level=NORMAL):
+        '''Waits for a turn to send a request, returns False if a POLL request was dropped'''
+        with self.__cond:
+            if self.__active < self.max_concurrent and not self.__waiting:
+                self.__active += 1
+                return True
+            #[level, order, granted], FIFO within a level
+            entry = [level, next(self.__order), False]
+            heapq.heappush(self.__waiting, entry)
+            deadline = None
+            if level == POLL and self.max_poll_wait is not None:
+                deadline = monotonic() + self.max_poll_wait
+            while not entry[2]:
+                timeout = None if deadline is None else deadline - monotonic()
+                if timeout is not None and timeout <= 0:
+                    self.__waiting.remove(entry)
+                    heapq.heapify(self.__waiting)
+                    self.dropped += 1
+                    return False
+                self.__cond.wait(timeout)
+            return True
+
+    def release(self):
+        '''Ends a request, handing its turn to the highest priority waiting request'''
+        with self.__cond:
+            if self.__waiting:
+                heapq.heappop(self.__waiting)[2] = True
+                self.__cond.notify_all()
+            else:
+                self.__active -= 1
@@ -0,0 +1,98 @@
+""" On disk store for router sessions, so short lived processes can skip the SCRAM login """
+import os
+import json
+import time
+import logging
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: #Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(object):
+    '''
+    Saves the session cookies, RSA public key and login time for each router and user to a JSON file.
+    Passwords are never stored. The file is created readable by the owner only,
+    and updates are made under an exclusive lock and written atomically.
+    '''
+    DEFAULT_PATH = os.path.join('~', '.huawei_lte', 'sessions.json')
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = os.path.expanduser(path)
+
+    @classmethod
+    def _key(cls, host, username):
+        return '%s@%s' % (username, host)
+
+    @contextmanager
+    def _locked(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            logger.warning('Ignoring corrupt session store %s', self.path)
+            return {}
+
+    def _write(self, sessions):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.sessions')
+        try:
+            os.chmod(tmp, 0o600)
+            with os.fdopen(fd, 'w') as file:
+                json.dump(sessions, file)
+            os.replace(tmp, self.path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def load(self, host, username, max_age):
+        '''Returns the saved session if it was logged in less than max_age seconds ago, otherwise None'''
+        with self._locked():
+            session = self._read().get(self._key(host, username))
+        if session is None:
+            return None
+        if time.time() - session['login_time'] >= max_age:
+            logger.debug('Saved session for %s has expired', self._key(host, username))
+            return None
+        return session
+
+    def save(self, host, username, cookies, rsae, rsan, login_time):
+        '''
+        cookies: list of {'name', 'value', 'domain', 'path'} dictionaries
+        login_time: time.time() of the login
+        '''
+        with self._locked():
+            sessions = self._read()
+            sessions[self._key(host, username)] = {
+                'cookies': cookies,
+                'rsae': rsae,
+                'rsan': rsan,
+                'login_time': login_time
+            }
+            self._write(sessions)
+
+    def remove(self, host, username):
+        with self._locked():
+            sessions = self._read()
+            if sessions.pop(self._key(host, username), None) is not None:
+                self._write(sessions)
@@ -0,0 +1,223 @@
+""" HTTP transport shared by router sessions, and transports recording and replaying the router's responses """
+import gzip
+import json
+import threading
+import logging
+from time import sleep
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from huawei_lte.wiretrace import WireTrace, REDACTED
+
+logger = logging.getLogger(__name__)
+
+class TransportStats(object):
+    '''Counts requests sent and the TCP connections opened to send them'''
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def reused(self):
+        '''Requests sent over an already open connection'''
+        return max(self.requests - self.connections, 0)
+
+    def add_request(self):
+        with self.__lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self.__lock:
+            self.connections += 1
+
+    def __repr__(self):
+        return 'TransportStats(requests=%i, connections=%i, reused=%i)' % (self.requests, self.connections, self.reused)
+
+def _counting_pool(base, stats):
+    #Connection objects are recycled by the pool, so count TCP connects rather than new objects
+    class CountingConnection(base.ConnectionCls):
+        def connect(self):
+            stats.add_connection()
+            return super(CountingConnection, self).connect()
+    class CountingPool(base):
+        ConnectionCls = CountingConnection
+    return CountingPool
+
+class PooledAdapter(HTTPAdapter):
+    '''HTTPAdapter that records connection reuse in a TransportStats'''
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.add_request()
+        return super(PooledAdapter, self).send(request, **kwargs)
+
+class Transport(object):
+    '''
+    Connection pool configuration for one or more routers.
+    A single Transport can be passed to many B525Router instances so they share one pool,
+    each router still gets its own session (and so its own cookies).
+
+    pool_connections: number of hosts to keep connection pools for
+    pool_maxsize: connections kept open per host, set to the number of threads sharing a router
+    pool_block: wait for a free connection rather than opening (and then discarding) an extra one
+    keepalive: False sends Connection: close, so every request opens a new connection
+    '''
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keepalive=True):
+        self.keepalive = keepalive
+        self.stats = TransportStats()
+        self.adapter = PooledAdapter(
+            self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+
+    def session(self):
+        '''Returns a new session using this transport's connection pool'''
+        session = requests.Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        if not self.keepalive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        self.adapter.close()
+
+def _open_cassette(path, mode):
+    #Cassettes ending in .gz are compressed
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def _request_path(url):
+    #Cassettes are recorded without the host, so they can be replayed for any router
+    parts = urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+class RecordingAdapter(PooledAdapter):
+    '''PooledAdapter that passes each request and response to a RecordingTransport'''
+    def __init__(self, stats, recorder, **kwargs):
+        self.recorder = recorder
+        super(RecordingAdapter, self).__init__(stats, **kwargs)
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        self.recorder.record(request, response)
+        return response
+
+class RecordingTransport(Transport):
+    '''
+    A Transport that writes every exchange with the router to a cassette for ReplayTransport.
+    Each line of the cassette is a JSON exchange: method, path, request body, status, response headers,
+    response body and the time the router took to respond. Tokens, cookies, passwords, proofs and keys
+    are redacted (see wiretrace), and encrypted request bodies are not kept.
+
+    path: the cassette to write, compressed if it ends in .gz
+    tracer: WireTrace used to redact, keep max_body=None so whole bodies are recorded
+    The other arguments are as for Transport, call close() to finish writing the cassette
+    '''
+    def __init__(self, path, tracer=None, pool_connections=10, pool_maxsize=10, pool_block=False, keepalive=True):
+        super(RecordingTransport, self).__init__(keepalive=keepalive)
+        self.path = path
+        self.tracer = tracer if tracer is not None else WireTrace(max_body=None)
+        self.__lock = threading.Lock()
+        self.__file = _open_cassette(path, 'w')
+        self.adapter = RecordingAdapter(
+            self.stats, self,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+
+    def record(self, request, response):
+        #Reading a streamed response here is fine, requests serves iter_content from the read body
+        encrypted = ';enc' in request.headers.get('Content-type', '')
+        exchange = {
+            'method': request.method,
+            'path': _request_path(request.url),
+            'body': REDACTED if encrypted and request.body else self.tracer.body(request.body),
+            'status': response.status_code,
+            'headers': self.tracer.headers(response.headers),
+            'content': self.tracer.body(response.content),
+            'elapsed': round(response.elapsed.total_seconds(), 4)
+        }
+        line = json.dumps(exchange, separators=(',', ':'))
+        with self.__lock:
+            self.__file.write(line + '\n')
+            self.__file.flush()
+
+    def close(self):
+        super(RecordingTransport, self).close()
+        with self.__lock:
+            self.__file.close()
+
+class ReplayAdapter(BaseAdapter):
+    '''Answers requests from a cassette instead of the network'''
+    def __init__(self, stats, exchanges, latency):
+        super(ReplayAdapter, self).__init__()
+        self.stats = stats
+        self.latency = latency
+        self.__lock = threading.Lock()
+        #Responses for the same method and path are replayed in the order recorded, then repeated
+        self.__exchanges = {}
+        self.__next = {}
+        for exchange in exchanges:
+            self.__exchanges.setdefault((exchange['method'], exchange['path']), []).append(exchange)
+
+    def __take(self, key):
+        with self.__lock:
+            recorded = self.__exchanges.get(key)
+            if not recorded:
+                return None
+            index = self.__next.get(key, 0)
+            self.__next[key] = (index + 1) % len(recorded)
+            return recorded[index]
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.stats.add_request()
+        exchange = self.__take((request.method, _request_path(request.url)))
+        if exchange is None:
+            raise ValueError('No recorded response for %s %s' % (request.method, _request_path(request.url)))
+        if self.latency:
+            sleep(exchange['elapsed'] * self.latency)
+        response = requests.Response()
+        response.status_code = exchange['status']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response.encoding = 'utf-8'
+        response._content = exchange['content'].encode('utf-8')
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+class ReplayTransport(Transport):
+    '''
+    A Transport answering from a cassette written by RecordingTransport, no router is needed.
+    e.g. router = B525Router('192.168.8.1', transport=ReplayTransport('b525.jsonl.gz'))
+    Any password can be used to log in, and requests that were not recorded return error 2000.
+
+    latency: multiple of the recorded response times to wait before answering, 0 answers at once
+    '''
+    def __init__(self, path, latency=0):
+        super(ReplayTransport, self).__init__()
+        self.path = path
+        with _open_cassette(path, 'r') as cassette:
+            exchanges = [json.loads(line) for line in cassette if line.strip()]
+        self.adapter = ReplayAdapter(self.stats, exchanges, latency)
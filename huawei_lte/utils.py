@@ -1,8 +1,31 @@
-from IPy import IP
 import re
+import importlib
+import html
 
-def isMacValid(mac): return re.match("[0-9a-f]{2}([-:]?)[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$", mac.lower())
+class LazyModule(object):
+    '''Defers importing a module until one of its attributes is first used'''
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+def escape(text):
+    '''Escapes &, < and > in text, as xml.sax.saxutils.escape does but without its import cost'''
+    return html.escape(text, quote=False)
+
+MAC_RE = re.compile("[0-9a-f]{2}([-:]?)[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$")
+
+def isMacValid(mac): return isinstance(mac, str) and MAC_RE.match(mac.lower()) is not None
+def normalizeMac(mac):
+    '''Returns a valid MAC address in lower case, colon separated form'''
+    digits = mac.lower().replace(':', '').replace('-', '')
+    return ':'.join(digits[i:i+2] for i in range(0, 12, 2))
 def isIpValid(ip):
+    from IPy import IP
     try:
         IP(ip)
         return True
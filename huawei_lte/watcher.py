@@ -0,0 +1,160 @@
+""" Watches the router's notification flags, reading other endpoints only when a flag changes
+
+    watcher = NotificationWatcher(router, interval=5)
+    watcher.subscribe(lambda event: print(event.flag, event.new, event.responses))
+    watcher.start()
+    ...
+    watcher.stop()
+
+or from asyncio
+    async for event in watcher.events():
+        ...
+"""
+import asyncio
+import logging
+import threading
+import xml.etree.ElementTree as ET
+
+import huawei_lte.scheduler as scheduler
+from huawei_lte.errors import RouterError
+
+logger = logging.getLogger(__name__)
+
+#Flags of monitoring/check-notifications, and the endpoints read when each one changes
+RELATED = {
+    'UnreadMessage': ('sms.count',),
+    'SmsStorageFull': ('sms.count',),
+    'OnlineUpdateStatus': ('device.info',),
+    'SimOperEvent': ('device.status', 'device.signal'),
+}
+
+class NotificationEvent(object):
+    '''
+    flag: the notification flag that changed, e.g. UnreadMessage
+    old, new: the flag's previous and current values
+    responses: endpoint name -> ElementTree root (or RouterError) of the flag's related endpoints
+    '''
+    __slots__ = ('flag', 'old', 'new', 'responses')
+
+    def __init__(self, flag, old, new, responses):
+        self.flag = flag
+        self.old = old
+        self.new = new
+        self.responses = responses
+
+    def __repr__(self):
+        return 'NotificationEvent(%s %s -> %s)' % (self.flag, self.old, self.new)
+
+class NotificationWatcher(object):
+    '''
+    Polls the lightweight monitoring.notifications endpoint every interval seconds.
+    When flags change the related endpoints are read (once per poll, concurrently) and an event is
+    published for each changed flag. The first poll only records the flags.
+
+    related: flag -> endpoint names, defaults to RELATED, flags not listed are ignored
+    '''
+    def __init__(self, router, interval=5, related=None):
+        self.router = router
+        self.interval = interval
+        self.related = dict(RELATED if related is None else related)
+        self.flags = None
+        #Requests made, to compare with polling every endpoint
+        self.polls = 0
+        self.fetches = 0
+        self.__subscribers = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def subscribe(self, callback, flags=None):
+        '''Calls callback(event) for changes to flags, or to any flag'''
+        with self.__lock:
+            self.__subscribers.append((callback, None if flags is None else set(flags)))
+
+    def unsubscribe(self, callback):
+        with self.__lock:
+            self.__subscribers = [s for s in self.__subscribers if s[0] is not callback]
+
+    def __read_flags(self):
+        self.polls += 1
+        response = self.router.call('monitoring.notifications')
+        if RouterError.hasError(response):
+            raise RouterError.fromResponse(response)
+        root = ET.fromstring(response)
+        return dict((elm.tag, (elm.text or '').strip()) for elm in root if elm.tag in self.related)
+
+    def __fetch(self, names):
+        if not names:
+            return {}
+        self.fetches += len(names)
+        responses = self.router.snapshot(names, parsed=True)
+        if isinstance(responses, str):
+            #snapshot failed as a whole and returned its XML error
+            error = RouterError.fromResponse(responses)
+            return dict((name, error) for name in names)
+        return responses
+
+    def poll(self):
+        '''Reads the flags once, returning an event for each flag that changed'''
+        #Requests wait behind other work on a router with a RequestScheduler
+        with scheduler.priority(scheduler.POLL):
+            return self.__poll()
+
+    def __poll(self):
+        flags = self.__read_flags()
+        previous, self.flags = self.flags, flags
+        if previous is None:
+            return []
+        changed = [flag for flag in flags if flags[flag] != previous.get(flag)]
+        names = []
+        for flag in changed:
+            names.extend(name for name in self.related[flag] if name not in names)
+        responses = self.__fetch(names)
+        return [NotificationEvent(flag, previous.get(flag), flags[flag],
+                                  dict((name, responses[name]) for name in self.related[flag]))
+                for flag in changed]
+
+    def publish(self, event):
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+        for callback, flags in subscribers:
+            if flags is None or event.flag in flags:
+                try:
+                    callback(event)
+                except Exception:
+                    logger.exception('Notification callback %r failed', callback)
+
+    def __poll_safely(self):
+        try:
+            return self.poll()
+        except (RouterError, ValueError) as err:
+            logger.warning('Reading notifications from %s failed: %s', self.router.router, err)
+            return []
+
+    def run(self):
+        '''Polls and publishes events until stop is called'''
+        while not self.__stop.is_set():
+            for event in self.__poll_safely():
+                self.publish(event)
+            self.__stop.wait(self.interval)
+
+    def start(self):
+        '''Runs the watcher on a daemon thread'''
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.run, name='NotificationWatcher', daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+
+    async def events(self, executor=None):
+        '''Yields events as they happen, the blocking requests are made on executor'''
+        loop = asyncio.get_running_loop()
+        while True:
+            for event in await loop.run_in_executor(executor, self.__poll_safely):
+                self.publish(event)
+                yield event
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,110 @@
+""" Sampled, redacted tracing of the requests and responses sent to the router
+
+Exchanges are logged at DEBUG to the huawei_lte.wire logger, so nothing is done unless it is enabled:
+    logging.getLogger('huawei_lte.wire').setLevel(logging.DEBUG)
+    wiretrace.configure(sample=10, max_body=1024)
+    listener = wiretrace.queue_logging(logging.FileHandler('wire.log'))
+
+Redaction, truncation and formatting are deferred until a handler formats the record,
+which happens on the listener's thread when queue_logging is used.
+"""
+import re
+import queue
+import logging
+import itertools
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger('huawei_lte.wire')
+
+REDACTED = '***'
+REDACT_HEADERS = ('__requestverificationtoken', 'cookie', 'set-cookie', 'authorization')
+#Elements such as <password>, <clientproof>, <token>, <WifiWpapsk>
+REDACT_ELEMENTS_RE = re.compile(r'<(\w*(?:password|passwd|token|proof|signature|nonce|psk|key)\w*)>[^<]*</\1>', re.IGNORECASE)
+
+class WireTrace(object):
+    '''
+    sample: trace one in every sample exchanges
+    max_body: characters of each body to keep, 0 for none, None for everything
+    '''
+    def __init__(self, sample=1, max_body=4096, redact_headers=REDACT_HEADERS, redact_elements=REDACT_ELEMENTS_RE):
+        if sample < 1:
+            raise ValueError('sample must be at least 1')
+        self.sample = sample
+        self.max_body = max_body
+        self.redact_headers = set(h.lower() for h in redact_headers)
+        self.redact_elements = redact_elements
+        self.__counter = itertools.count()
+
+    def sampled(self):
+        return next(self.__counter) % self.sample == 0
+
+    def headers(self, headers):
+        return dict((key, REDACTED if key.lower() in self.redact_headers else value)
+                    for key, value in (headers or {}).items())
+
+    def body(self, body):
+        if body is None:
+            return ''
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        #Redact before truncating, so that part of a secret is never left at the cut
+        if self.redact_elements is not None:
+            body = self.redact_elements.sub(lambda m: '<%s>%s</%s>' % (m.group(1), REDACTED, m.group(1)), body)
+        size = len(body)
+        if self.max_body is not None and size > self.max_body:
+            body = '%s... [%i of %i truncated]' % (body[:self.max_body], size - self.max_body, size)
+        return body
+
+class Exchange(object):
+    '''A logged request and response, only formatted when a handler needs the message'''
+    __slots__ = ('tracer', 'method', 'url', 'request_headers', 'data', 'status', 'response_headers', 'content')
+
+    def __init__(self, tracer, method, url, request_headers, data, response):
+        self.tracer = tracer
+        self.method = method
+        self.url = url
+        self.request_headers = dict(request_headers or {})
+        self.data = data
+        self.status = response.status_code
+        self.response_headers = dict(response.headers)
+        self.content = response.content
+
+    def __str__(self):
+        tracer = self.tracer
+        return '\n'.join([
+            '%s %s' % (self.method.upper(), self.url),
+            '> %s' % tracer.headers(self.request_headers),
+            '> %s' % tracer.body(self.data),
+            '< %i %s' % (self.status, tracer.headers(self.response_headers)),
+            '< %s' % tracer.body(self.content)])
+
+tracer = WireTrace()
+
+def configure(**kwargs):
+    '''Replaces the tracer, see WireTrace for the arguments'''
+    global tracer
+    tracer = WireTrace(**kwargs)
+    return tracer
+
+def trace(method, url, headers, data, response):
+    '''Logs the exchange if it is sampled, callers check logger.isEnabledFor(logging.DEBUG) first'''
+    current = tracer
+    if current.sampled():
+        logger.debug('%s', Exchange(current, method, url, headers, data, response))
+
+class _DeferredQueueHandler(QueueHandler):
+    '''Queues the record as it is, so that the message is formatted on the listener's thread'''
+    def prepare(self, record):
+        return record
+
+def queue_logging(*handlers):
+    '''
+    Sends wire trace records to handlers from a background thread instead of the requesting thread.
+    Returns the started QueueListener, stop() it to flush the remaining records
+    '''
+    records = queue.Queue()
+    logger.addHandler(_DeferredQueueHandler(records))
+    logger.propagate = False
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
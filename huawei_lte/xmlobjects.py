@@ -1,15 +1,44 @@
 import xml.etree.ElementTree as ET
-import inspect
 
 import huawei_lte.utils as utils
+import huawei_lte.instrument as instrument
 from huawei_lte.errors import RouterError
 
+def iterparse_items(chunks, list_tag):
+    '''
+    Yields the XML of each entry in the root's list_tag element, e.g. each <Host> of <response><Hosts>,
+    as soon as it has arrived from chunks (an iterable of bytes such as response.iter_content()).
+    Entries are dropped from the tree once yielded, so memory use does not grow with the list.
+    Raises RouterError if the response is an error
+    '''
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    path = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elm in parser.read_events():
+            if event == 'start':
+                path.append(elm)
+                continue
+            path.pop()
+            if len(path) == 2 and path[1].tag == list_tag:
+                yield ET.tostring(elm, encoding='unicode')
+                path[1].remove(elm)
+            elif not path and elm.tag == 'error':
+                raise RouterError.fromCode(elm.findtext('code', '0').strip(), elm.findtext('message'))
+    parser.close()
+
 class XmlObject(object):
     '''A simple object to handle XML object serialisation'''
+    #Empty so that subclasses can use __slots__, subclasses without them still get a __dict__
+    __slots__ = ()
+    #Class defaults, overridden per instance by the settings passed to __init__
+    _SKIP_BLANK = False
+    _SKIP_CLASS_ELEMENT = False
 
     def __init__(self, settings=None):
-        self._SKIP_BLANK = self._get_param(settings, 'skip_blanks', False)
-        self._SKIP_CLASS_ELEMENT = self._get_param(settings, 'skip_class_element', False)
+        if settings is not None:
+            self._SKIP_BLANK = self._get_param(settings, 'skip_blanks', False)
+            self._SKIP_CLASS_ELEMENT = self._get_param(settings, 'skip_class_element', False)
 
     @classmethod
     def _get_param(cls, vals, key, default=None):
@@ -33,6 +62,14 @@ class XmlObject(object):
     def buildXmlResponse(self): return self.buildXML(root='response')
     def buildXmlError(self): return self.buildXML(root='error')
     def buildXML(self, header=True, root='request'):
+        start = instrument.clock()
+        if start is None:
+            return self._buildXML(header, root)
+        xml = self._buildXML(header, root)
+        instrument.record('build.' + self.__class__.__name__, start, bytes=len(xml))
+        return xml
+
+    def _buildXML(self, header, root):
         result = []
         if (header):
             result.append('<?xml version="1.0" encoding="UTF-8"?>')
@@ -68,15 +105,21 @@ class XmlObject(object):
         return None
 
     def parseXML(self, xmlText):
+        start = instrument.clock()
+        if start is None:
+            return self._parseXML(xmlText)
+        self._parseXML(xmlText)
+        instrument.record('parse.' + self.__class__.__name__, start, bytes=len(xmlText))
+
+    def _parseXML(self, xmlText):
         xml = ET.fromstring(xmlText.encode('utf-8'))
         for prop in self.getPropertyNames():
             value = self.getValue(prop)
             if isinstance(value, list):
                 parent = xml.find('./'+prop)
                 if (parent is not None):
-                    for elm in parent.getchildren():
-                        xml = ET.tostring(elm, encoding='utf8', method='xml')
-                        child = self.child(prop, xml)
+                    for elm in parent:
+                        child = self.child(prop, ET.tostring(elm, encoding='unicode', method='xml'))
                         value.append(child)
             elif (issubclass(type(value), XmlObject)):
                 elm = xml.find('./'+prop)
@@ -91,8 +134,32 @@ class XmlObject(object):
                         val = ''
                     setattr(self, prop, val)
 
+class XmlModel(XmlObject):
+    '''
+    Compact base for the records kept in long lists.
+    Subclasses declare their XML elements in order as __slots__, so instances have no __dict__,
+    and set _SKIP_BLANK / _SKIP_CLASS_ELEMENT as class attributes
+    '''
+    __slots__ = ()
+    __FIELDS = {}
+
+    def getPropertyNames(self):
+        cls = self.__class__
+        fields = XmlModel.__FIELDS.get(cls)
+        if fields is None:
+            fields = []
+            for base in reversed(cls.__mro__):
+                slots = base.__dict__.get('__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                fields.extend(slot for slot in slots if slot[:1] != '_')
+            fields = XmlModel.__FIELDS[cls] = tuple(fields)
+        return fields
+
 class Error(XmlObject):
     PYTHON_API_ERROR_CODE=2000
+    ROUTER_UNAVAILABLE_ERROR_CODE=2001
+    REQUEST_DROPPED_ERROR_CODE=2002
 
     def __init__(self, code=0, msg=''):
         super(Error, self).__init__()
@@ -106,22 +173,29 @@ class Error(XmlObject):
         error = Error(code, msg % (caller, err))
         return error.buildXmlError()
 
+    @classmethod
+    def xml_unavailable(cls, host):
+        code = cls.ROUTER_UNAVAILABLE_ERROR_CODE
+        msg = RouterError.getErrorMessage(code)
+        error = Error(code, msg % host)
+        return error.buildXmlError()
+
     def parseXML(self, xmlText):
         super(Error, self).parseXML(xmlText)
         if (self.message == ''):
             #lookup error message
             self.message = RouterError.getErrorMessage(self.code)
             
-class Function(XmlObject):
+class Function(XmlModel):
+    __slots__ = ('Name', 'Url', 'Error')
+    _SKIP_BLANK = True
+
     def __init__(self, typ, name, url):
-        super(Function, self).__init__({'skip_blanks': True})
+        super(Function, self).__init__()
         self.Name = '%s.%s' % (typ.lower(), name)
         self.Url = 'api/%s' % url
         self.Error = ''
 
-    def getPropertyNames(self):
-        return ['Name','Url','Error']
-
 class TestFunctions(XmlObject):
     def __init__(self):
         super(TestFunctions, self).__init__()
@@ -138,8 +212,8 @@ class TestFunctions(XmlObject):
     def getPropertyNames(self):
         return ['DeviceName','ProductFamily','HardwareVersion','SoftwareVersion','WebUIVersion','MacAddress1','MacAddress2','Failed','Passed']
 
-    def addFunction(self, obj, name, url, response):
-        func = Function(obj.__class__.__name__, name, url)
+    def addFunction(self, typ, name, url, response):
+        func = Function(typ, name, url)
         if (RouterError.hasError(response)):
             error = Error()
             error.parseXML(response)
@@ -169,6 +243,31 @@ class VirtualServerCollection(XmlObject):
             raise ValueError('Unable to add port forward [%s], it already exists!' % newserver.VirtualServerIPName)
         self.Servers.append(newserver)
 
+    def sync(self, configs):
+        '''
+        Replaces the servers with those in configs (add_service settings), matched by name.
+        Returns lists of the added, removed and changed server names
+        '''
+        desired = [VirtualServer(config) for config in configs]
+        current = {}
+        for server in self.Servers:
+            current[server.VirtualServerIPName] = server
+        names = set()
+        added = []
+        changed = []
+        for server in desired:
+            name = server.VirtualServerIPName
+            if name in names:
+                raise ValueError('Port forward [%s] is specified more than once' % name)
+            names.add(name)
+            if name not in current:
+                added.append(name)
+            elif not server.equals(current[name]):
+                changed.append(name)
+        removed = [name for name in current if name not in names]
+        self.Servers = desired
+        return added, removed, changed
+
     def remove_service(self, name):
         found = False
         for server in self.Servers:
@@ -187,7 +286,10 @@ class VirtualServerCollection(XmlObject):
         config['protocol'] = 'TCP'
         self.add_service(config)
 
-class VirtualServer(XmlObject):
+class VirtualServer(XmlModel):
+    __slots__ = ('VirtualServerIPName', 'VirtualServerStatus', 'VirtualServerRemoteIP',
+                 'VirtualServerWanPort', 'VirtualServerWanEndPort', 'VirtualServerLanPort',
+                 'VirtualServerLanEndPort', 'VirtualServerIPAddress', 'VirtualServerProtocol')
     PROTOCOLS = {'UDP': 17, 'TCP': 6, 'BOTH': 0}
     def __init__(self, config):
         #Define properties first to support XML serialisation
@@ -213,7 +315,7 @@ class VirtualServer(XmlObject):
             localIp = self._get_param(config, 'localip')
             protocol = self._get_param(config, 'protocol', 'BOTH')
             if protocol not in self.PROTOCOLS:
-                raise ValueError('Invalid protocol specified for port forwarding (Virtual Server). Must be one of: [%s]' % ', '.join(self.PROTOCOLS.keys))
+                raise ValueError('Invalid protocol specified for port forwarding (Virtual Server). Must be one of: [%s]' % ', '.join(self.PROTOCOLS.keys()))
             protocol = self.PROTOCOLS[protocol]
             if not utils.isIpValid(localIp):
                 raise ValueError('Invalid ipaddress specified for port fowarding target server')
@@ -228,6 +330,13 @@ class VirtualServer(XmlObject):
     def getElementName(self):
         return 'Server'
 
+    def equals(self, other):
+        '''True if both servers have the same settings, values read from the router are strings'''
+        for prop in self.getPropertyNames():
+            if str(self.getValue(prop)) != str(other.getValue(prop)):
+                return False
+        return True
+
 class DataswitchMode(XmlObject):
 
     def __init__(self):
@@ -243,6 +352,103 @@ class DataswitchMode(XmlObject):
     def set_dataswitch_off(self):
         self.dataswitch = 0 
 
+class BandTable(object):
+    '''
+    Precomputed bit masks for a table of band names, in table order.
+    Bands are indexed by the lowest bit of their mask so decoding only visits set bits.
+    '''
+    def __init__(self, masks):
+        self.names = list(masks.keys())
+        self.masks = dict(masks)
+        self.rank = {}
+        self.by_low_bit = {}
+        self.known = 0
+        for i, name in enumerate(self.names):
+            mask = self.masks[name]
+            self.rank[name] = i
+            self.by_low_bit.setdefault(mask & -mask, []).append((name, mask))
+            self.known |= mask
+
+    @classmethod
+    def from_band_numbers(cls, bands):
+        '''Bands named B<n> use bit n-1'''
+        return cls(dict((band, 1 << (int(band[1:]) - 1)) for band in bands))
+
+    @classmethod
+    def from_hex_masks(cls, bands):
+        return cls(dict((band, int(mask, 16)) for band, mask in bands.items()))
+
+    def mask(self, band):
+        if band not in self.masks:
+            raise ValueError('Band [%s] is not one of: %s' % (band, ', '.join(self.names)))
+        return self.masks[band]
+
+class BandSet(object):
+    '''
+    An immutable set of bands from a BandTable, held as the router's bit mask.
+    Bits not in the table are kept, so a mask read from the router is written back unchanged.
+    '''
+    __slots__ = ('_table', '_mask')
+
+    def __init__(self, table, bands=(), mask=None):
+        if mask is None:
+            mask = 0
+            for band in bands:
+                mask |= table.mask(band)
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_mask', mask)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BandSet is immutable')
+
+    @classmethod
+    def from_hex(cls, table, hexnum):
+        return cls(table, mask=int(hexnum, 16) if hexnum else 0)
+
+    @property
+    def mask(self): return self._mask
+
+    def to_hex(self):
+        '''Upper case hex without a prefix, as used by the router'''
+        return '%X' % self._mask
+
+    def __iter__(self):
+        '''Yields the bands in table order'''
+        found = []
+        rest = self._mask & self._table.known
+        while rest:
+            low = rest & -rest
+            rest ^= low
+            for band, mask in self._table.by_low_bit.get(low, ()):
+                if self._mask & mask == mask:
+                    found.append(band)
+        rank = self._table.rank
+        return iter(sorted(found, key=rank.__getitem__))
+
+    def __contains__(self, band):
+        mask = self._table.masks.get(band)
+        return mask is not None and self._mask & mask == mask
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __eq__(self, other):
+        return isinstance(other, BandSet) and self._table is other._table and self._mask == other._mask
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._table), self._mask))
+
+    def __or__(self, other):
+        if not isinstance(other, BandSet):
+            other = BandSet(self._table, other)
+        return BandSet(self._table, mask=self._mask | other._mask)
+
+    def __repr__(self):
+        return 'BandSet([%s], 0x%s)' % (', '.join(self), self.to_hex())
+
 class NetworkMode(XmlObject):
     NET_MODES = {
         'AUTO': '00',
@@ -285,6 +491,9 @@ class NetworkMode(XmlObject):
         'B40': 'TDD 2300 Mhz',
         'B41': 'TDD 2500 Mhz'}
 
+    LTE_TABLE = BandTable.from_band_numbers(LTE_BANDS)
+    NET_TABLE = BandTable.from_hex_masks(NET_BANDS)
+
     @classmethod
     def get_mode(cls, mode):
         '''
@@ -300,44 +509,28 @@ class NetworkMode(XmlObject):
         '''
         Returns bands as hex
         '''
-        result = 0
-        for band in bands:
-            result += 2 ** (int(band[1:]) - 1)
-        return hex(result)
+        return hex(BandSet(cls.LTE_TABLE, bands).mask)
 
     @classmethod
     def lte_from_hex(cls, hexnum):
         '''
         Returns list of bands from provided hex
         '''
-        result = []
-        for band in cls.LTE_BANDS.keys():
-            bint = 2 ** (int(band[1:]) - 1)
-            if int(hexnum,16) & bint == bint:
-                result.append(band)
-        return result
+        return list(BandSet.from_hex(cls.LTE_TABLE, hexnum))
 
     @classmethod
     def band_to_hex(cls, bands):
         '''
         Returns bands as hex
         '''
-        result = 0
-        for band in bands:
-            result += int(cls.NET_BANDS[band], 16)
-        return hex(result)
+        return hex(BandSet(cls.NET_TABLE, bands).mask)
 
     @classmethod
     def band_from_hex(cls, hexnum):
         '''
         Returns list of bands from provided hex
         '''
-        result = []
-        for band, val in cls.NET_BANDS.items():
-            bint = int(val, 16)
-            if int(hexnum, 16) & bint == bint:
-                result.append(band)
-        return result
+        return list(BandSet.from_hex(cls.NET_TABLE, hexnum))
 
     def __init__(self):
         '''
@@ -350,23 +543,31 @@ class NetworkMode(XmlObject):
         self.NetworkBand = ''
         self.LTEBand = ''
 
-    @classmethod
-    def __clean_hex(cls, hexnum):
-        return hexnum.replace('0x','').replace('L','').upper()
+    @property
+    def lte_bands(self):
+        return BandSet.from_hex(self.LTE_TABLE, self.LTEBand)
+
+    @property
+    def network_bands(self):
+        return BandSet.from_hex(self.NET_TABLE, self.NetworkBand)
 
     def set_lte_band(self, bands):
-        for band in bands:
-            if band not in self.LTE_BANDS.keys():
-                raise ValueError('Band [%s] is not a known LTE band. Expected format is B1, B2 etc...' % band)
-        hexnum = self.lte_to_hex(bands)
-        self.LTEBand = self.__clean_hex(hexnum)
+        '''bands is a BandSet or a list of LTE band names'''
+        if not isinstance(bands, BandSet):
+            for band in bands:
+                if band not in self.LTE_BANDS.keys():
+                    raise ValueError('Band [%s] is not a known LTE band. Expected format is B1, B2 etc...' % band)
+            bands = BandSet(self.LTE_TABLE, bands)
+        self.LTEBand = bands.to_hex()
 
     def set_network_band(self, bands):
-        for band in bands:
-            if band not in self.NET_BANDS.keys():
-                raise ValueError('Band [%s] is not a known 2G/3G band. Expected format is GSM800, W1900, etc...' % band)
-        hexnum = self.band_to_hex(bands)
-        self.NetworkBand = self.__clean_hex(hexnum)
+        '''bands is a BandSet or a list of 2G/3G band names'''
+        if not isinstance(bands, BandSet):
+            for band in bands:
+                if band not in self.NET_BANDS.keys():
+                    raise ValueError('Band [%s] is not a known 2G/3G band. Expected format is GSM800, W1900, etc...' % band)
+            bands = BandSet(self.NET_TABLE, bands)
+        self.NetworkBand = bands.to_hex()
 
     def set_network_mode(self, mode):
         if mode not in self.NET_MODES.keys():
@@ -425,7 +626,8 @@ class LanSettings(XmlObject):
     def setDhcpOff(self):
         self.DhcpStatus = 0
 
-class MacFilter(XmlObject):
+class MacFilter(XmlModel):
+    __slots__ = ('value', 'status')
     def __init__(self, value):
         super(MacFilter, self).__init__()
         if not utils.isMacValid(value):
@@ -481,6 +683,53 @@ class StaticHostCollection(XmlObject):
         for i in range(len(self.Hosts)):
             self.Hosts[i].HostIndex = i+1
 
+    def sync(self, hosts):
+        '''
+        Replaces the static hosts with hosts, a dictionary of MAC address -> IP address or a list of
+        (MAC address, IP address) pairs. MAC addresses are normalised, then every address is validated
+        and checked for duplicates and conflicts before anything changes.
+        Returns lists of the added, removed and changed MAC addresses
+        '''
+        errors = []
+        desired = {}
+        owners = {}
+        for mac, ip in (hosts.items() if isinstance(hosts, dict) else hosts):
+            if not utils.isMacValid(mac):
+                errors.append('invalid MAC address %s' % mac)
+                continue
+            if not utils.isIpValid(ip):
+                errors.append('invalid IP address %s for %s' % (ip, mac))
+                continue
+            mac = utils.normalizeMac(mac)
+            if mac in desired:
+                errors.append('MAC address %s is listed more than once' % mac)
+            elif ip in owners:
+                errors.append('IP address %s is assigned to both %s and %s' % (ip, owners[ip], mac))
+            desired[mac] = ip
+            owners.setdefault(ip, mac)
+        if errors:
+            raise ValueError('Invalid static hosts: %s' % '; '.join(errors))
+
+        current = {}
+        for host in self.Hosts:
+            current[utils.normalizeMac(host.HostHw)] = host
+        added = []
+        changed = []
+        result = []
+        for mac, ip in desired.items():
+            host = current.get(mac)
+            if host is None:
+                added.append(mac)
+                host = StaticHost({StaticHost.P_MAC_ADDRESS: mac, StaticHost.P_IP_ADDRESS: ip}, validate=False)
+            elif host.HostIp != ip:
+                changed.append(mac)
+                host.HostIp = ip
+            host.HostIndex = len(result)+1
+            result.append(host)
+        removed = [mac for mac in current if mac not in desired]
+        self.Hosts = result
+        return added, removed, changed
+
     def getElementName(self):
         return 'Hosts'
 
@@ -490,14 +739,15 @@ class StaticHostCollection(XmlObject):
         else:
             return None
 
-class StaticHost(XmlObject):
+class StaticHost(XmlModel):
     '''
     Represents an static IP Address for a specific MAC address
     '''
+    __slots__ = ('HostIndex', 'HostHw', 'HostIp', 'HostEnabled')
     P_MAC_ADDRESS = 'macaddress'
     P_IP_ADDRESS = 'ipaddress'
 
-    def __init__(self, config):
+    def __init__(self, config, validate=True):
         super(StaticHost, self).__init__()
         self.HostIndex = 0
         self.HostHw = ''
@@ -508,8 +758,9 @@ class StaticHost(XmlObject):
         else:
             mac = self._get_param(config, self.P_MAC_ADDRESS)
             ip = self._get_param(config, self.P_IP_ADDRESS)
-            if (not utils.isMacValid(mac)): raise ValueError("Invalid static host MAC address: %s" % mac)
-            if (not utils.isIpValid(ip)): raise ValueError("Invalid static host IP Address: %s" % ip)
+            if validate:
+                if (not utils.isMacValid(mac)): raise ValueError("Invalid static host MAC address: %s" % mac)
+                if (not utils.isIpValid(ip)): raise ValueError("Invalid static host IP Address: %s" % ip)
             self.HostHw = mac
             self.HostIp = ip
     
@@ -588,7 +839,8 @@ class SipServer(XmlObject):
         self.secondregisterserverport = self._get_param(config, self.P_REGISTER_PORT)
         self.secondsipserverdomain = self._get_param(config, self.P_SIP_DOMAIN)
 
-class SipAccount(XmlObject):
+class SipAccount(XmlModel):
+    __slots__ = ('username', 'password', 'account', 'registerstatus', 'index')
     P_ACCOUNT = 'account'
     P_USERNAME = 'username'
     P_PASSWORD = 'password'
@@ -636,7 +888,8 @@ class VoiceSettings(XmlObject):
         self.cid_send_type = self.CID_DTMF if self._get_param(config, self.P_CID_SEND_TYPE).upper() == 'DTMF' else self.CID_FSK
         self.cs_dtmf_method = self.DTMF_OUTBAND if self._get_param(config, self.P_CS_DTMF_METHOD).upper() == 'OUTBAND' else self.DTMF_INBAND
 
-class Ddns(XmlObject):
+class Ddns(XmlModel):
+    __slots__ = ('provider', 'username', 'password', 'domainname', 'status', 'index')
     P_USERNAME = 'username'
     P_PASSWORD = 'password'
     P_PROVIDER = 'provider'
@@ -698,6 +951,60 @@ class DdnsCollection(XmlObject):
     def setToEdit(self):
         self.operate = self.OPERATE_EDIT
 
+class SmsListRequest(XmlObject):
+    '''A page of the sms/sms-list request, BoxType 1 is the inbox'''
+    def __init__(self, page, count, box=1, unread_first=False):
+        super(SmsListRequest, self).__init__()
+        self.PageIndex = page
+        self.ReadCount = count
+        self.BoxType = box
+        self.SortType = 0
+        self.Ascending = 0
+        self.UnreadPreferred = 1 if unread_first else 0
+
+class SmsMessage(XmlModel):
+    '''An SMS, Smstat is 0 when unread and 1 when read'''
+    __slots__ = ('Smstat', 'Index', 'Phone', 'Content', 'Date', 'Sca', 'SaveType', 'Priority', 'SmsType')
+
+    def __init__(self, xml=None):
+        super(SmsMessage, self).__init__()
+        for prop in self.__slots__:
+            setattr(self, prop, '')
+        if xml is not None:
+            self.parseXML(xml)
+
+    @property
+    def unread(self):
+        return str(self.Smstat) == '0'
+
+    def getElementName(self):
+        return 'Message'
+
+class SmsCollection(XmlObject):
+    '''A page of sms/sms-list, Count is the number of messages in the box'''
+    def __init__(self):
+        super(SmsCollection, self).__init__()
+        self.Count = 0
+        self.Messages = []
+
+    def child(self, name, xml):
+        if name == 'Messages':
+            return SmsMessage(xml)
+        return None
+
+class SmsIndexes(XmlObject):
+    '''The messages to delete or mark as read, sent as repeated <Index> elements'''
+    def __init__(self, indexes):
+        super(SmsIndexes, self).__init__()
+        self.Index = [str(index) for index in indexes]
+
+    def _buildXML(self, header, root):
+        result = ['<?xml version="1.0" encoding="UTF-8"?><%s>' % root if header else '']
+        result.extend('<Index>%s</Index>' % index for index in self.Index)
+        if header:
+            result.append('</%s>' % root)
+        return ''.join(result)
+
 class ConnectionMode(XmlObject):
     '''
     Represents an ethernet configuration
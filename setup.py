@@ -29,6 +29,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         'huawei_lte>=2.0.0',
+        'requests>=2.20.0',
         'pycrypto>=2.6.1',
         'IPy>=1.0.0'
     ],
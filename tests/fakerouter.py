@@ -0,0 +1,121 @@
+''' A minimal stand-in for the router's web server, used by the tests '''
+import time
+import threading
+import uuid
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+TOKEN_HEADER = '__RequestVerificationToken'
+
+def xml_response(body):
+    return '<?xml version="1.0" encoding="UTF-8"?><response>%s</response>' % body
+
+def xml_error(code):
+    return '<?xml version="1.0" encoding="UTF-8"?><error><code>%s</code><message></message></error>' % code
+
+class FakeRouter(ThreadingMixIn, HTTPServer):
+    '''
+    Serves canned GET responses and accepts any login.
+    Every POST uses up the current verification token, like the real router.
+    Setting session_rejected makes API calls fail with 125002 until the next login.
+    Setting delay makes API GET requests wait that many seconds before answering.
+    post_handlers maps API paths to functions taking the POSTed XML and returning the response.
+    '''
+    daemon_threads = True
+
+    def __init__(self, responses=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeRouterHandler)
+        self.responses = responses if responses is not None else {}
+        self.posts = []
+        self.requests = []
+        self.lock = threading.Lock()
+        self.token = uuid.uuid4().hex
+        self.session_rejected = False
+        self.delay = 0
+        self.post_handlers = {}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return '127.0.0.1:%i' % self.server_port
+
+    def new_token(self):
+        self.token = uuid.uuid4().hex
+        return self.token
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+class FakeRouterHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'SessionID=fake; path=/')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(('GET', self.path))
+        if self.path == '/':
+            return self.reply('<html><head><title>HUAWEI</title></head></html>')
+        if self.path == '/api/webserver/token':
+            return self.reply(xml_response('<token>%s%s</token>' % ('0' * 32, server.token)))
+        path = self.path[len('/api/'):]
+        if server.delay:
+            time.sleep(server.delay)
+        if server.session_rejected:
+            return self.reply(xml_error(125002))
+        if path in server.responses:
+            return self.reply(server.responses[path])
+        return self.reply(xml_error(100002))
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length).decode('utf-8')
+        path = self.path[len('/api/'):]
+        with server.lock:
+            server.requests.append(('POST', self.path))
+            if self.headers.get(TOKEN_HEADER) != server.token:
+                return self.reply(xml_error(125003))
+            if server.session_rejected and not path.startswith('user/'):
+                return self.reply(xml_error(125002))
+            token = server.new_token()
+            server.posts.append((path, data))
+        headers = {TOKEN_HEADER: token}
+        if path == 'user/challenge_login':
+            return self.reply(xml_response(
+                '<salt>00</salt><iterations>1</iterations><servernonce>abc</servernonce>'), headers)
+        if path == 'user/authentication_login':
+            server.session_rejected = False
+            return self.reply(xml_response('<rsae>010001</rsae><rsan>%s</rsan>' % RSAN), headers)
+        if path in server.post_handlers:
+            return self.reply(server.post_handlers[path](data), headers)
+        return self.reply(xml_response('OK'), headers)
+
+#2048 bit modulus, only used to exercise encryption
+RSAN = (
+    'c2a5c1a1c5d3b8e8c4f1f6a9e2b7d3c8a4f5e6d7c8b9a0f1e2d3c4b5a6978879'
+    '6a5b4c3d2e1f0a9b8c7d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b'
+    '4c3d2e1f0a9b8c7d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d'
+    '2e1f0a9b8c7d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f'
+    '0a9b8c7d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b'
+    '8c7d6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b8c7d'
+    '6e5f4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b8c7d6e5f'
+    '4a3b2c1d0e9f8a7b6c5d4e3f2a1b0c9d8e7f6a5b4c3d2e1f0a9b8c7d6e5f4a3b')
@@ -1,10 +1,994 @@
 import os
 from os.path import join, dirname
 import unittest
+import threading
+import tempfile
+from http.server import HTTPServer, BaseHTTPRequestHandler
 import huawei_lte.router as lte
 import huawei_lte.xmlobjects as xmlobjects
 import logging
 from dotenv import load_dotenv
+from huawei_lte.breaker import CircuitBreaker
+from huawei_lte.errors import RouterError
+import fakerouter
+
+class Breaker(unittest.TestCase):
+
+    def test_open_circuit_fails_fast(self):
+        #Nothing listens on the discard port, so connections are refused
+        router = lte.B525Router('127.0.0.1:9', timeout=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        try:
+            router.login('admin', 'secret')
+        except Exception:
+            pass
+        try:
+            router.login('admin', 'secret')
+        except Exception:
+            pass
+        self.assertEqual(router.breaker.state, CircuitBreaker.OPEN)
+        response = router.api('device/information')
+        self.assertTrue(RouterError.hasError(response))
+        self.assertTrue('<code>2001</code>' in response)
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.before_call(), CircuitBreaker.HALF_OPEN)
+        #Only one caller probes
+        self.assertEqual(breaker.before_call(), CircuitBreaker.OPEN)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.before_call(), CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.before_call(), CircuitBreaker.CLOSED)
+
+    def test_router_closes_after_probe(self):
+        import time
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        import threading
+        class TokenHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b'<?xml version="1.0" encoding="UTF-8"?><response><token>%s</token></response>' % (b'0' * 64)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = HTTPServer(('127.0.0.1', 0), TokenHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            router = lte.B525Router('127.0.0.1:%i' % server.server_port, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1))
+            router.breaker.record_failure()
+            self.assertTrue('<code>2001</code>' in router.api('device/signal'))
+            time.sleep(0.15)
+            #The token endpoint answers, so the breaker closes and the request is sent
+            self.assertFalse('<code>2001</code>' in router.api('device/signal'))
+            self.assertEqual(router.breaker.state, CircuitBreaker.CLOSED)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+class Fleet(unittest.TestCase):
+
+    class FakeRouter(object):
+        def __init__(self, host, response):
+            self.router = host
+            self.response = response
+            self.rebooted = False
+        def reboot(self, down_timeout, ready_timeout):
+            self.rebooted = True
+            if isinstance(self.response, Exception):
+                raise self.response
+            return self.response
+
+    def test_rolling_reboot_stops_after_failure(self):
+        from huawei_lte.fleet import rolling_reboot
+        ok = '<response><DeviceName>B525s-65a</DeviceName></response>'
+        failed = xmlobjects.Error.xml_error('reboot', 'not ready')
+        routers = [self.FakeRouter('a', ok), self.FakeRouter('b', failed), self.FakeRouter('c', ok)]
+        results = rolling_reboot(routers, concurrency=1)
+        self.assertEqual(results['a'], ok)
+        self.assertEqual(results['b'], failed)
+        self.assertFalse(routers[2].rebooted)
+        self.assertTrue(RouterError.hasError(results['c']))
+
+    def test_rolling_reboot_counts_raised_errors(self):
+        from huawei_lte.fleet import rolling_reboot
+        ok = '<response><DeviceName>B525s-65a</DeviceName></response>'
+        routers = [self.FakeRouter('a', ok), self.FakeRouter('b', RouterError.fromCode(2001)),
+                   self.FakeRouter('c', ValueError('not ready')), self.FakeRouter('d', ok)]
+        results = rolling_reboot(routers, concurrency=1, max_failures=1)
+        self.assertEqual(results['a'], ok)
+        self.assertTrue('<code>2001</code>' in results['b'])
+        self.assertTrue('not ready' in results['c'])
+        self.assertFalse(routers[3].rebooted)
+        self.assertTrue(RouterError.hasError(results['d']))
+
+class Transport(unittest.TestCase):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def do_GET(self):
+            body = b'<?xml version="1.0" encoding="UTF-8"?><response><token>x</token></response>'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), self.Handler)
+        self.url = 'http://127.0.0.1:%i/api/webserver/token' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        from huawei_lte.transport import Transport
+        transport = Transport()
+        session = transport.session()
+        for _ in range(3):
+            session.get(self.url, timeout=5)
+        self.assertEqual(transport.stats.requests, 3)
+        self.assertEqual(transport.stats.connections, 1)
+        self.assertEqual(transport.stats.reused, 2)
+
+    def test_keepalive_off(self):
+        from huawei_lte.transport import Transport
+        transport = Transport(keepalive=False)
+        session = transport.session()
+        for _ in range(3):
+            session.get(self.url, timeout=5)
+        self.assertEqual(transport.stats.connections, 3)
+
+class Cassette(unittest.TestCase):
+
+    def test_record_and_replay(self):
+        import time
+        from huawei_lte.transport import RecordingTransport, ReplayTransport
+        responses = {
+            'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>'),
+            'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = join(tmp, 'b525.jsonl.gz')
+            with fakerouter.FakeRouter(responses) as server:
+                recorder = RecordingTransport(path)
+                router = lte.B525Router(server.host, transport=recorder)
+                router.login('admin', 'secret')
+                token = server.token
+                recorded = [router.device.info, router.device.signal, router.device.signal]
+                recorder.close()
+            import gzip
+            with gzip.open(path, 'rt') as cassette:
+                text = cassette.read()
+            self.assertFalse(token in text)
+            self.assertTrue('<token>***</token>' in text)
+            self.assertTrue('"__RequestVerificationToken":"***"' in text)
+
+            replay = ReplayTransport(path)
+            router = lte.B525Router('192.0.2.1', transport=replay)
+            router.login('admin', 'anything')
+            self.assertEqual([router.device.info, router.device.signal, router.device.signal], recorded)
+            self.assertTrue('<code>2000</code>' in router.device.status)
+            self.assertEqual(replay.stats.connections, 0)
+
+            #Recorded response times are scaled by latency
+            path = join(tmp, 'signal.jsonl')
+            with open(path, 'w') as cassette:
+                cassette.write('{"method":"GET","path":"/api/device/signal","body":"","status":200,"headers":{},'
+                               '"content":"<response><rsrp>-95dBm</rsrp></response>","elapsed":0.05}\n')
+            session = ReplayTransport(path, latency=2).session()
+            start = time.monotonic()
+            self.assertEqual(session.get('http://192.0.2.1/api/device/signal').text, '<response><rsrp>-95dBm</rsrp></response>')
+            self.assertTrue(time.monotonic() - start >= 0.1)
+
+class Concurrency(unittest.TestCase):
+
+    def test_concurrent_calls(self):
+        responses = {'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            errors = []
+            def worker():
+                for i in range(10):
+                    if i % 3 == 0:
+                        response = router.api('device/control', {'Control': 0})
+                    else:
+                        response = router.device.signal
+                    if RouterError.hasError(response):
+                        errors.append(response)
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(len([p for p in server.posts if p[0] == 'device/control']), 8 * 4)
+
+    def test_invalid_token_is_retried(self):
+        with fakerouter.FakeRouter() as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            router.device.info
+            #Use up the cached token behind the router's back
+            server.new_token()
+            response = router.api('device/control', {'Control': 0})
+            self.assertFalse(RouterError.hasError(response))
+
+class Session(unittest.TestCase):
+
+    def test_resume_saved_session(self):
+        from huawei_lte.session import SessionStore
+        responses = {'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>')}
+        with tempfile.TemporaryDirectory() as tmp, fakerouter.FakeRouter(responses) as server:
+            store = SessionStore(os.path.join(tmp, 'sessions.json'))
+            lte.B525Router(server.host, session_store=store).login('admin', 'secret')
+            self.assertEqual(os.stat(store.path).st_mode & 0o777, 0o600)
+            logins = len(server.posts)
+
+            router = lte.B525Router(server.host, session_store=store)
+            router.login('admin', 'secret')
+            self.assertEqual(len(server.posts), logins)
+            self.assertFalse(RouterError.hasError(router.device.info))
+
+            #Falls back to a full login when the router rejects the saved session
+            server.session_rejected = True
+            router = lte.B525Router(server.host, session_store=store)
+            router.login('admin', 'secret')
+            self.assertFalse(RouterError.hasError(router.device.info))
+            self.assertTrue(len(server.posts) > logins)
+
+class Endpoints(unittest.TestCase):
+
+    def test_registry(self):
+        import huawei_lte.endpoints as endpoints
+        self.assertEqual(endpoints.lookup('device.signal').path, 'device/signal')
+        self.assertTrue(endpoints.lookup('wan.set_ddns').encrypted)
+        self.assertFalse(endpoints.lookup('device.control').idempotent)
+        self.assertTrue(isinstance(lte.Device.__dict__['info'], endpoints.accessor))
+
+    def test_call_and_features(self):
+        import asyncio
+        responses = {
+            'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>'),
+            'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            self.assertEqual(router.device.signal, responses['device/signal'])
+            self.assertEqual(router.call('device.signal'), responses['device/signal'])
+            self.assertEqual(asyncio.run(router.acall('device.signal')), responses['device/signal'])
+            self.assertTrue('Unknown endpoint' in router.call('device.nothing'))
+            self.assertFalse(RouterError.hasError(router.call('device.control', {'Control': 0})))
+            self.assertEqual(server.posts[-1][0], 'device/control')
+            features = router.features
+            self.assertTrue('<DeviceName>B525s-65a</DeviceName>' in features)
+            self.assertTrue('<Passed><Function><Name>device.info</Name><Url>api/device/information</Url></Function>' in features)
+            self.assertTrue('<Name>security.timerule</Name>' in features)
+
+class Errors(unittest.TestCase):
+
+    def test_typed_errors(self):
+        from huawei_lte.errors import RouterSessionError, RouterUnsupportedError
+        err = RouterError.fromResponse(fakerouter.xml_error(125002))
+        self.assertTrue(isinstance(err, RouterSessionError))
+        self.assertEqual(err.code, '125002')
+        self.assertEqual(err.message, 'Invalid session')
+        self.assertTrue(isinstance(RouterError.fromCode(100002), RouterUnsupportedError))
+        self.assertEqual(type(RouterError.fromCode(100005)), RouterError)
+        self.assertTrue('<message>Invalid session</message>' in err.buildXmlError())
+
+    def test_raise_errors(self):
+        from huawei_lte.errors import RouterUnsupportedError
+        responses = {'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            self.assertTrue('<code>100002</code>' in router.device.signal)
+            router.raise_errors = True
+            with self.assertRaises(RouterUnsupportedError):
+                router.device.signal
+            with self.assertRaises(ValueError):
+                router.call('device.nothing')
+            self.assertEqual(router.device.info, responses['device/information'])
+            #Probe failures are still listed
+            self.assertTrue('<Name>device.signal</Name>' in router.features)
+
+    def test_raise_errors_when_unreachable(self):
+        import requests
+        from huawei_lte.errors import RouterUnavailableError
+        #Nothing listens on the discard port, so connections are refused
+        router = lte.B525Router('127.0.0.1:9', timeout=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60), raise_errors=True)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            router.login('admin', 'secret')
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            router.api('device/signal')
+        with self.assertRaises(RouterUnavailableError):
+            router.api('device/signal')
+        with self.assertRaises(RouterUnavailableError):
+            router.device.signal
+        router.raise_errors = False
+        self.assertTrue('<code>2001</code>' in router.device.signal)
+
+class Discovery(unittest.TestCase):
+
+    def test_scan_and_features(self):
+        import huawei_lte.discovery as discovery
+        responses = {'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>')}
+        with fakerouter.FakeRouter(responses) as server, tempfile.TemporaryDirectory() as tmp:
+            port = server.server_port
+            entries = discovery.discover(['127.0.0.1/32', '127.0.0.2/31'], port=port, concurrency=4, timeout=1,
+                                         username='admin', password='secret')
+            self.assertEqual([entry['host'] for entry in entries], [server.host])
+            self.assertTrue(entries[0]['huawei'])
+            self.assertEqual(entries[0]['features']['device_name'], 'B525s-65a')
+            self.assertTrue('device.info' in entries[0]['features']['passed'])
+            self.assertTrue('device.signal' in entries[0]['features']['failed'])
+            path = join(tmp, 'inventory.json')
+            discovery.write_inventory(path, entries, ['127.0.0.1/32'])
+            self.assertEqual(discovery.read_inventory(path), entries)
+            #Hosts that are not identified as Huawei are not sent the login
+            logins = [path for path, _ in server.posts].count('user/authentication_login')
+            other = {'host': server.host, 'huawei': False}
+            discovery.probe_features([other], 'admin', 'secret')
+            self.assertFalse('features' in other)
+            self.assertEqual([path for path, _ in server.posts].count('user/authentication_login'), logins)
+        #Nothing is listening any more
+        self.assertEqual(discovery.discover(['127.0.0.1/32'], port=port, timeout=0.5), [])
+
+class Snapshot(unittest.TestCase):
+
+    def test_snapshot(self):
+        import time
+        from huawei_lte.errors import RouterUnsupportedError
+        responses = {
+            'device/information': fakerouter.xml_response('<DeviceName>B525s-65a</DeviceName>'),
+            'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            server.delay = 0.2
+            start = time.monotonic()
+            snapshot = router.snapshot()
+            self.assertTrue(time.monotonic() - start < 0.2 * len(router.SNAPSHOT) / 2)
+            self.assertTrue(snapshot.startswith('<?xml version="1.0" encoding="UTF-8"?><response><part name="device.info"><response><DeviceName>'))
+            self.assertTrue('<part name="ethernet.status"><error><code>100002</code>' in snapshot)
+            parts = router.snapshot(['device.signal', 'lan.clients'], parsed=True)
+            self.assertEqual(parts['device.signal'].findtext('rsrp'), '-95dBm')
+            self.assertTrue(isinstance(parts['lan.clients'], RouterUnsupportedError))
+            self.assertTrue('<code>2000</code>' in router.snapshot(['device.control']))
+
+    def test_token_is_read_once(self):
+        responses = {'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            server.delay = 0.1
+            del server.requests[:]
+            router.snapshot()
+            self.assertEqual(server.requests.count(('GET', '/api/webserver/token')), 1)
+
+class Watcher(unittest.TestCase):
+
+    def notifications(self, unread, update):
+        return fakerouter.xml_response('<UnreadMessage>%i</UnreadMessage><SmsStorageFull>0</SmsStorageFull>'
+                                       '<OnlineUpdateStatus>%i</OnlineUpdateStatus><SimOperEvent>0</SimOperEvent>' % (unread, update))
+
+    def test_related_endpoints_read_on_change(self):
+        from huawei_lte.watcher import NotificationWatcher
+        responses = {
+            'monitoring/check-notifications': self.notifications(0, 10),
+            'device/information': fakerouter.xml_response('<SoftwareVersion>11.0.1.1</SoftwareVersion>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            watcher = NotificationWatcher(router)
+            events = []
+            watcher.subscribe(events.append, ['OnlineUpdateStatus'])
+            for _ in range(3):
+                self.assertEqual(watcher.poll(), [])
+            responses['monitoring/check-notifications'] = self.notifications(1, 11)
+            changed = watcher.poll()
+            self.assertEqual([(e.flag, e.old, e.new) for e in changed], [('UnreadMessage', '0', '1'), ('OnlineUpdateStatus', '10', '11')])
+            self.assertEqual(changed[1].responses['device.info'].findtext('SoftwareVersion'), '11.0.1.1')
+            self.assertEqual((watcher.polls, watcher.fetches), (4, 2))
+            for event in changed:
+                watcher.publish(event)
+            self.assertEqual(events, changed[1:])
+
+    def test_async_events(self):
+        import asyncio
+        from huawei_lte.watcher import NotificationWatcher
+        responses = {'monitoring/check-notifications': self.notifications(0, 10)}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            watcher = NotificationWatcher(router, interval=0.05)
+            async def first_event():
+                async for event in watcher.events():
+                    return event
+            async def change():
+                await asyncio.sleep(0.2)
+                responses['monitoring/check-notifications'] = self.notifications(2, 10)
+            async def main():
+                return (await asyncio.gather(first_event(), change()))[0]
+            event = asyncio.run(main())
+            self.assertEqual((event.flag, event.new, list(event.responses)), ('UnreadMessage', '2', ['sms.count']))
+
+class Sms(unittest.TestCase):
+
+    class Inbox(object):
+        '''The router's side of sms-list, delete-sms and set-read'''
+        def __init__(self, count):
+            self.messages = dict((40000 + i, 0) for i in range(count))
+            self.pages = []
+
+        def list(self, data):
+            import xml.etree.ElementTree as ET
+            request = ET.fromstring(data)
+            page, count = int(request.findtext('PageIndex')), int(request.findtext('ReadCount'))
+            self.pages.append(page)
+            indexes = sorted(self.messages)[(page - 1) * count:page * count]
+            #Count is the number of messages in the page, not in the box
+            return fakerouter.xml_response('<Count>%i</Count><Messages>%s</Messages>' % (len(indexes), ''.join(
+                '<Message><Smstat>%i</Smstat><Index>%i</Index><Phone>Telco</Phone><Content>Used %i MB</Content>'
+                '<Date>2020-01-01 10:00:00</Date></Message>' % (self.messages[i], i, i) for i in indexes)))
+
+        def indexes(self, data):
+            import xml.etree.ElementTree as ET
+            return [int(elm.text) for elm in ET.fromstring(data).findall('Index')]
+
+        def delete(self, data):
+            for index in self.indexes(data):
+                del self.messages[index]
+            return fakerouter.xml_response('OK')
+
+        def set_read(self, data):
+            for index in self.indexes(data):
+                self.messages[index] = 1
+            return fakerouter.xml_response('OK')
+
+    def router(self, server, inbox):
+        server.post_handlers = {'sms/sms-list': inbox.list, 'sms/delete-sms': inbox.delete, 'sms/set-read': inbox.set_read}
+        router = lte.B525Router(server.host)
+        router.login('admin', 'secret')
+        return router
+
+    def test_pages(self):
+        import time
+        import asyncio
+        inbox = self.Inbox(25)
+        with fakerouter.FakeRouter() as server:
+            router = self.router(server, inbox)
+            messages = router.sms.iter_messages(page_size=10)
+            first = next(messages)
+            self.assertEqual((first.Index, first.Content, first.unread), ('40000', 'Used 40000 MB', True))
+            #The second page is read while the first is processed
+            for _ in range(100):
+                if len(inbox.pages) > 1:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(inbox.pages, [1, 2])
+            self.assertEqual(len(list(messages)), 24)
+            self.assertEqual(inbox.pages, [1, 2, 3])
+
+            async def read():
+                return [message.Index async for message in router.sms.aiter_messages(page_size=10)]
+            self.assertEqual(len(asyncio.run(read())), 25)
+
+            #A full last page needs one more read to find the end
+            del inbox.pages[:]
+            self.assertEqual(len(list(router.sms.iter_messages(page_size=5))), 25)
+            self.assertEqual(inbox.pages, [1, 2, 3, 4, 5, 6])
+
+            posts = len(server.posts)
+            self.assertFalse(RouterError.hasError(router.sms.mark_read(list(inbox.messages)[:12], batch=5)))
+            self.assertEqual(len(server.posts) - posts, 3)
+            self.assertEqual(sum(inbox.messages.values()), 12)
+
+    def test_drain(self):
+        inbox = self.Inbox(25)
+        with fakerouter.FakeRouter() as server:
+            router = self.router(server, inbox)
+            drained = [message.Index for message in router.sms.drain(page_size=10)]
+            self.assertEqual(len(set(drained)), 25)
+            self.assertEqual(inbox.messages, {})
+            self.assertEqual([path for path, _ in server.posts].count('sms/delete-sms'), 3)
+
+    def test_async_priority(self):
+        import asyncio
+        import huawei_lte.scheduler as scheduler
+        with fakerouter.FakeRouter() as server:
+            router = self.router(server, self.Inbox(5))
+            router.scheduler = scheduler.RequestScheduler(max_concurrent=1, max_poll_wait=0.05)
+            router.scheduler.acquire()
+            #Freed later, so a read that lost the POLL priority completes rather than being dropped
+            threading.Timer(0.5, router.scheduler.release).start()
+            async def read():
+                with scheduler.priority(scheduler.POLL):
+                    return [message.Index async for message in router.sms.aiter_messages()]
+            try:
+                asyncio.run(read())
+                self.assertTrue(False, 'The read did not wait as a POLL')
+            except RouterError as err:
+                self.assertEqual(err.code, '2002')
+
+class Broker(unittest.TestCase):
+
+    def test_clients_share_one_login(self):
+        from huawei_lte.broker import SessionBroker, BrokerServer, BrokerRouter
+        responses = {
+            'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp><rssi>-67dBm</rssi>'),
+            'timerule/timerule': fakerouter.xml_response('<TimeRules></TimeRules>')}
+        with fakerouter.FakeRouter(responses) as router, tempfile.TemporaryDirectory() as tmp:
+            broker = SessionBroker({router.host: {'username': 'admin', 'password': 'secret'}})
+            server = BrokerServer(broker, join(tmp, 'broker.sock'))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                self.assertEqual(os.stat(server.path).st_mode & 0o777, 0o600)
+                self.assertRaises(OSError, BrokerServer, broker, server.path)
+                for _ in range(3):
+                    with BrokerRouter(router.host, server.path) as client:
+                        self.assertEqual(client.device.signal, responses['device/signal'])
+                with BrokerRouter(router.host, server.path) as client:
+                    self.assertTrue('<SignalStrength>' in client.device.signal_strength)
+                    self.assertEqual(client.api('device/signal'), responses['device/signal'])
+                    self.assertEqual(client.security.timerule(), responses['timerule/timerule'])
+                    self.assertFalse(RouterError.hasError(client.call('device.control', {'Control': 0})))
+                    self.assertTrue('<code>100002</code>' in client.device.info)
+                    self.assertTrue('<code>2000</code>' in client.net.set_lte_band({'bands': ['B99']}))
+                with BrokerRouter('192.0.2.1', server.path) as client:
+                    self.assertTrue('not configured' in client.device.signal)
+                self.assertEqual([path for path, _ in router.posts].count('user/authentication_login'), 1)
+            finally:
+                server.shutdown()
+                server.server_close()
+                broker.logout()
+            self.assertFalse(os.path.exists(server.path))
+
+class Scheduler(unittest.TestCase):
+
+    def test_writes_go_before_polls(self):
+        import time
+        import huawei_lte.scheduler as scheduler
+        responses = {'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host, scheduler=scheduler.RequestScheduler(max_concurrent=1, max_poll_wait=None))
+            router.login('admin', 'secret')
+            server.delay = 0.2
+            def poll():
+                with scheduler.priority(scheduler.POLL):
+                    router.device.signal
+            threads = [threading.Thread(target=poll) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            #One poll is sent and the others queue behind it
+            deadline = time.monotonic() + 5
+            while router.scheduler.waiting < 3:
+                self.assertTrue(time.monotonic() < deadline, 'the polls did not queue')
+                time.sleep(0.005)
+            self.assertFalse(RouterError.hasError(router.call('device.control', {'Control': 0})))
+            for thread in threads:
+                thread.join()
+        requests = [r for r in server.requests if r[1] in ('/api/device/signal', '/api/device/control')]
+        #The write waited for the poll being sent, but not for those queued before it
+        self.assertEqual(requests.index(('POST', '/api/device/control')), 1)
+        self.assertEqual(len(requests), 5)
+
+    def test_stale_polls_are_dropped(self):
+        import time
+        import huawei_lte.scheduler as scheduler
+        from huawei_lte.errors import RouterBusyError
+        responses = {'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host, scheduler=scheduler.RequestScheduler(max_concurrent=1, max_poll_wait=0.05))
+            router.login('admin', 'secret')
+            server.delay = 0.3
+            reader = threading.Thread(target=lambda: router.device.signal)
+            reader.start()
+            time.sleep(0.05)
+            with scheduler.priority(scheduler.POLL):
+                self.assertTrue('<code>2002</code>' in router.device.signal)
+                self.assertTrue(isinstance(RouterError.fromResponse(router.device.signal), RouterBusyError))
+            reader.join()
+            self.assertEqual(router.scheduler.dropped, 2)
+            self.assertEqual(router.device.signal, responses['device/signal'])
+
+    def test_async_call_keeps_priority(self):
+        import asyncio
+        import huawei_lte.scheduler as scheduler
+        responses = {'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host, scheduler=scheduler.RequestScheduler(max_concurrent=1, max_poll_wait=0.05))
+            router.login('admin', 'secret')
+            router.scheduler.acquire()
+            #Freed later, so a call that lost the POLL priority completes rather than being dropped
+            threading.Timer(0.5, router.scheduler.release).start()
+            async def poll():
+                with scheduler.priority(scheduler.POLL):
+                    return await router.acall('device.signal')
+            self.assertTrue('<code>2002</code>' in asyncio.run(poll()))
+
+    def test_streams_take_a_slot(self):
+        import huawei_lte.scheduler as scheduler
+        responses = {
+            'dhcp/static-addr-info': StaticHosts.HOSTS,
+            'device/signal': fakerouter.xml_response('<rsrp>-95dBm</rsrp>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host, scheduler=scheduler.RequestScheduler(max_concurrent=1, max_poll_wait=0.05))
+            router.login('admin', 'secret')
+            self.assertEqual(len(list(router.lan.iter_static_hosts())), 2)
+            router.scheduler.acquire()
+            with scheduler.priority(scheduler.POLL):
+                try:
+                    list(router.lan.iter_static_hosts())
+                    self.assertTrue(False, 'Stream was not queued')
+                except RouterError as err:
+                    self.assertEqual(err.code, '2002')
+            router.scheduler.release()
+            self.assertEqual(len(list(router.lan.iter_static_hosts())), 2)
+            #The slot is only held while sending, so the router can be called between entries
+            reads = []
+            def iterate():
+                for host in router.lan.iter_static_hosts():
+                    reads.append(router.device.signal)
+            thread = threading.Thread(target=iterate, daemon=True)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), 'Calling the router while iterating a stream deadlocked')
+            self.assertEqual(reads, [responses['device/signal']] * 2)
+
+class Instrument(unittest.TestCase):
+
+    def test_collector(self):
+        import huawei_lte.instrument as instrument
+        responses = {'net/net-mode': fakerouter.xml_response('<NetworkMode>00</NetworkMode><NetworkBand>3FFFFFFF</NetworkBand><LTEBand>5</LTEBand>')}
+        collector = instrument.HistogramCollector()
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            instrument.add(collector)
+            try:
+                router.net.set_lte_band({'bands': ['B3']})
+                router.api('device/unknown')
+            finally:
+                instrument.remove(collector)
+            router.device.info
+        summary = collector.summary()
+        self.assertEqual(summary['api']['count'], 3)
+        self.assertEqual(summary['api']['errors'], {100002: 1})
+        self.assertEqual(summary['http.post']['count'], 1)
+        self.assertEqual(summary['parse.NetworkMode']['count'], 1)
+        self.assertTrue(summary['build.NetworkMode']['bytes'] > 0)
+        self.assertTrue(summary['api']['p95'] <= summary['api']['max'])
+        self.assertFalse(instrument.enabled())
+
+class WireTrace(unittest.TestCase):
+
+    class Records(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    def test_sampled_and_redacted(self):
+        import huawei_lte.wiretrace as wiretrace
+        records = self.Records()
+        wire = logging.getLogger('huawei_lte.wire')
+        level = wire.level
+        wire.setLevel(logging.DEBUG)
+        wiretrace.configure(max_body=120)
+        listener = wiretrace.queue_logging(records)
+        try:
+            with fakerouter.FakeRouter() as server:
+                router = lte.B525Router(server.host)
+                router.login('admin', 'secret')
+                logged = len(server.requests)
+                wiretrace.configure(sample=3)
+                for _ in range(6):
+                    router.api('device/information')
+        finally:
+            listener.stop()
+            wire.handlers = []
+            wire.propagate = True
+            wire.setLevel(level)
+            wiretrace.configure()
+        #Seven exchanges after the login, the first call also fetches a token
+        self.assertEqual(len(records.messages), logged + 3)
+        text = '\n'.join(records.messages)
+        self.assertFalse(server.token in text)
+        self.assertTrue("'__RequestVerificationToken': '***'" in text)
+        self.assertTrue('<clientproof>***</clientproof>' in text)
+        self.assertTrue('truncated]' in text)
+
+class Crypto(unittest.TestCase):
+
+    def test_rsa_encrypt_round_trip(self):
+        from binascii import unhexlify
+        import base64
+        import huawei_lte.crypto as crypto
+        from Crypto.PublicKey import RSA
+        from Crypto.Cipher import PKCS1_v1_5
+        key = RSA.generate(2048)
+        data = '<request>%s</request>' % ('x' * 1000)
+        result = unhexlify(crypto.rsa_encrypt('%x' % key.e, '%x' % key.n, data))
+        #Each 245 byte block of base64 data encrypts to 256 bytes
+        self.assertEqual(len(result), 256 * 6)
+        cipher = PKCS1_v1_5.new(key)
+        plain = b''.join(cipher.decrypt(result[i:i+256], None) for i in range(0, len(result), 256))
+        self.assertEqual(base64.b64decode(plain).decode('utf-8'), data)
+
+    def test_executor(self):
+        import huawei_lte.crypto as crypto
+        from concurrent.futures import ThreadPoolExecutor
+        args = ('a' * 64, 'b' * 64, 'secret', 'ab' * 16, 100)
+        expected = crypto.get_client_proof(*args)
+        for executor in [ThreadPoolExecutor(2), crypto.use_process_pool(2)]:
+            crypto.set_executor(executor)
+            try:
+                self.assertEqual(crypto.get_client_proof(*args), expected)
+            finally:
+                crypto.set_executor(None)
+                executor.shutdown()
+
+class PortForwards(unittest.TestCase):
+
+    SERVERS = fakerouter.xml_response(
+        '<Servers>'
+        '<Server><VirtualServerIPName>IPSEC1</VirtualServerIPName><VirtualServerStatus>1</VirtualServerStatus>'
+        '<VirtualServerRemoteIP></VirtualServerRemoteIP><VirtualServerWanPort>500</VirtualServerWanPort>'
+        '<VirtualServerWanEndPort>500</VirtualServerWanEndPort><VirtualServerLanPort>500</VirtualServerLanPort>'
+        '<VirtualServerLanEndPort>500</VirtualServerLanEndPort><VirtualServerIPAddress>192.168.8.11</VirtualServerIPAddress>'
+        '<VirtualServerProtocol>17</VirtualServerProtocol></Server>'
+        '<Server><VirtualServerIPName>WEB</VirtualServerIPName><VirtualServerStatus>1</VirtualServerStatus>'
+        '<VirtualServerRemoteIP></VirtualServerRemoteIP><VirtualServerWanPort>80</VirtualServerWanPort>'
+        '<VirtualServerWanEndPort>80</VirtualServerWanEndPort><VirtualServerLanPort>80</VirtualServerLanPort>'
+        '<VirtualServerLanEndPort>80</VirtualServerLanEndPort><VirtualServerIPAddress>192.168.8.12</VirtualServerIPAddress>'
+        '<VirtualServerProtocol>6</VirtualServerProtocol></Server>'
+        '</Servers>')
+
+    IPSEC1 = {'name': 'IPSEC1', 'startwanport': 500, 'startlanport': 500, 'localip': '192.168.8.11', 'protocol': 'UDP'}
+
+    def test_sync(self):
+        settings = xmlobjects.VirtualServerCollection()
+        settings.parseXML(self.SERVERS)
+        self.assertEqual(len(settings.Servers), 2)
+        added, removed, changed = settings.sync([
+            self.IPSEC1,
+            {'name': 'IPSEC2', 'startwanport': 4500, 'startlanport': 4500, 'localip': '192.168.8.11', 'protocol': 'UDP'}])
+        self.assertEqual((added, removed, changed), (['IPSEC2'], ['WEB'], []))
+        settings = xmlobjects.VirtualServerCollection()
+        settings.parseXML(self.SERVERS)
+        changed = dict(self.IPSEC1, localip='192.168.8.13')
+        self.assertEqual(settings.sync([changed])[2], ['IPSEC1'])
+
+    def test_sync_port_forwards(self):
+        with fakerouter.FakeRouter({'security/virtual-servers': self.SERVERS}) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            logins = len(server.posts)
+            response = router.wan.sync_port_forwards([self.IPSEC1])
+            self.assertTrue('<Removed><Name>WEB</Name></Removed>' in response)
+            self.assertEqual(len(server.posts), logins + 1)
+            self.assertFalse('WEB' in server.posts[-1][1])
+            #Nothing to change, so nothing is written
+            router.wan.sync_port_forwards([
+                self.IPSEC1,
+                {'name': 'WEB', 'startwanport': 80, 'startlanport': 80, 'localip': '192.168.8.12', 'protocol': 'TCP'}])
+            self.assertEqual(len(server.posts), logins + 1)
+
+class StaticHosts(unittest.TestCase):
+
+    HOSTS = fakerouter.xml_response(
+        '<Hosts>'
+        '<Host><HostIndex>1</HostIndex><HostHw>92:1B:46:9D:BE:86</HostHw><HostIp>192.168.8.100</HostIp><HostEnabled>1</HostEnabled></Host>'
+        '<Host><HostIndex>2</HostIndex><HostHw>92:1b:46:9d:be:87</HostHw><HostIp>192.168.8.101</HostIp><HostEnabled>1</HostEnabled></Host>'
+        '</Hosts>')
+
+    def test_sync(self):
+        settings = xmlobjects.StaticHostCollection()
+        settings.parseXML(self.HOSTS)
+        added, removed, changed = settings.sync({
+            '92-1b-46-9d-be-86': '192.168.8.100',
+            '92:1b:46:9d:be:88': '192.168.8.101'})
+        self.assertEqual(added, ['92:1b:46:9d:be:88'])
+        self.assertEqual(removed, ['92:1b:46:9d:be:87'])
+        self.assertEqual(changed, [])
+        self.assertEqual([host.HostIndex for host in settings.Hosts], [1, 2])
+
+    def test_sync_validates_everything_first(self):
+        settings = xmlobjects.StaticHostCollection()
+        settings.parseXML(self.HOSTS)
+        try:
+            settings.sync({
+                '92:1b:46:9d:be:86': '192.168.8.110',
+                '92:1b:46:9d:be:87': '192.168.8.110',
+                'fred': '192.168.8.111'})
+            self.assertTrue(False, 'Invalid hosts')
+        except ValueError as err:
+            self.assertTrue('fred' in str(err))
+            self.assertTrue('192.168.8.110 is assigned to both' in str(err))
+        self.assertEqual(settings.Hosts[0].HostIp, '192.168.8.100')
+
+    def test_sync_list_normalises_before_checking(self):
+        import huawei_lte.utils as utils
+        self.assertFalse(utils.isMacValid(None))
+        responses = {'dhcp/static-addr-info': self.HOSTS}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            response = router.lan.sync_static_hosts([
+                {'macaddress': '92:1b:46:9d:be:90', 'ipaddress': '192.168.8.120'},
+                {'macaddress': '92-1B-46-9D-BE-90', 'ipaddress': '192.168.8.121'},
+                {'macaddress': None, 'ipaddress': '192.168.8.122'}])
+            self.assertTrue('92:1b:46:9d:be:90 is listed more than once' in response)
+            self.assertTrue('invalid MAC address None' in response)
+            self.assertFalse('dhcp/static-addr-info' in [path for path, _ in server.posts])
+
+    def test_compact_model(self):
+        settings = xmlobjects.StaticHostCollection()
+        settings.parseXML(self.HOSTS)
+        host = settings.Hosts[0]
+        self.assertFalse(hasattr(host, '__dict__'))
+        self.assertEqual(host.buildXML(False),
+            '<HostIndex>1</HostIndex><HostHw>92:1B:46:9D:BE:86</HostHw><HostIp>192.168.8.100</HostIp><HostEnabled>1</HostEnabled>')
+        self.assertTrue('<Host><HostIndex>2</HostIndex>' in settings.buildXML())
+
+class Streaming(unittest.TestCase):
+
+    def test_entries_are_yielded_as_they_arrive(self):
+        body = fakerouter.xml_response('<Hosts>%s</Hosts>' % ''.join(
+            '<Host><ID>%i</ID></Host>' % i for i in range(100))).encode('utf-8')
+        fed = []
+        def chunks():
+            for i in range(0, len(body), 7):
+                fed.append(i)
+                yield body[i:i+7]
+        items = xmlobjects.iterparse_items(chunks(), 'Hosts')
+        self.assertEqual(next(items), '<Host><ID>0</ID></Host>')
+        self.assertTrue(len(fed) < 20)
+        self.assertEqual(len(list(items)), 99)
+
+    def test_error_response(self):
+        try:
+            list(xmlobjects.iterparse_items([fakerouter.xml_error(100002).encode('utf-8')], 'Hosts'))
+            self.assertTrue(False, 'Error response')
+        except RouterError as err:
+            self.assertEqual(err.code, '100002')
+
+    def test_iter_static_hosts(self):
+        responses = {
+            'dhcp/static-addr-info': StaticHosts.HOSTS,
+            'security/virtual-servers': fakerouter.xml_response('<Servers></Servers>')}
+        with fakerouter.FakeRouter(responses) as server:
+            router = lte.B525Router(server.host)
+            router.login('admin', 'secret')
+            hosts = list(router.lan.iter_static_hosts())
+            self.assertEqual([host.HostIp for host in hosts], ['192.168.8.100', '192.168.8.101'])
+            self.assertEqual(list(router.wan.iter_port_forwards()), [])
+            server.session_rejected = True
+            self.assertEqual(len(list(router.lan.iter_static_hosts())), 2)
+
+class Bands(unittest.TestCase):
+
+    def test_round_trip(self):
+        net = xmlobjects.NetworkMode()
+        net.LTEBand = '80080000C5'
+        net.NetworkBand = '100200000CE80380'
+        self.assertEqual(list(net.lte_bands), ['B1', 'B3', 'B7', 'B8', 'B28', 'B40'])
+        self.assertTrue('EXTRA' in net.network_bands)
+        net.set_lte_band(net.lte_bands)
+        self.assertEqual(net.LTEBand, '80080000C5')
+        net.set_network_band(list(net.network_bands))
+        self.assertEqual(net.NetworkBand, '100200000CE80380')
+        self.assertEqual(xmlobjects.NetworkMode.lte_to_hex(['B1', 'B3', 'B1']), '0x5')
+
+    def test_unknown_bits_are_kept(self):
+        bands = xmlobjects.BandSet.from_hex(xmlobjects.NetworkMode.LTE_TABLE, '101')
+        self.assertEqual(list(bands), ['B1'])
+        self.assertEqual(bands.to_hex(), '101')
+
+class BandSweep(unittest.TestCase):
+
+    class FakeRouter(object):
+        '''Signal and download rate depend on the locked LTE bands'''
+        SIGNAL = {'5': (-100, 5, 10000000), '4': (-90, 15, 40000000), '80000000': (-110, 2, 1000000)}
+        def __init__(self):
+            self.router = 'fake'
+            self.lte = '5'
+            self.switches = []
+            self.busy = 0
+            self.net = self.device = self.monitoring = self
+            self.api = self.enc_api = self.call = None
+        @property
+        def mode(self):
+            return fakerouter.xml_response('<NetworkMode>00</NetworkMode><NetworkBand>3FFFFFFF</NetworkBand><LTEBand>%s</LTEBand>' % self.lte)
+        def set_lte_band(self, config):
+            net = xmlobjects.NetworkMode()
+            net.set_lte_band(config['bands'])
+            self.lte = net.LTEBand
+            self.switches.append(self.lte)
+            return fakerouter.xml_response('OK')
+        @property
+        def status(self):
+            #As a router with raise_errors does while it reattaches
+            if self.busy:
+                self.busy -= 1
+                raise RouterError.fromCode(100004)
+            return fakerouter.xml_response('<ConnectionStatus>901</ConnectionStatus>')
+        @property
+        def signal(self):
+            return fakerouter.xml_response('<rsrp>%idBm</rsrp><sinr>%idB</sinr>' % self.SIGNAL[self.lte][:2])
+        @property
+        def traffic(self):
+            return fakerouter.xml_response('<CurrentDownloadRate>%i</CurrentDownloadRate>' % self.SIGNAL[self.lte][2])
+
+    def test_sweep_applies_best(self):
+        from huawei_lte.bandsweep import BandSweep
+        router = self.FakeRouter()
+        sweep = BandSweep(router, [['B32'], ['B1', 'B3'], ['B3'], ['B3']], samples=3, sample_interval=0, settle_time=0)
+        results = sweep.run()
+        self.assertEqual([list(result.bands) for result in results], [['B3'], ['B1', 'B3'], ['B32']])
+        #B1+B3 was already set, B3 is only measured once, B32 is given up after two samples
+        self.assertEqual(router.switches, ['80000000', '4'])
+        self.assertTrue(results[2].dominated)
+        self.assertEqual(len(results[2].samples), 2)
+        self.assertEqual(router.lte, '4')
+
+    def test_sweep_waits_through_raised_errors(self):
+        from huawei_lte.bandsweep import BandSweep
+        router = self.FakeRouter()
+        router.busy = 2
+        results = BandSweep(router, [['B3']], samples=1, min_samples=1, sample_interval=0, settle_time=0).run()
+        self.assertEqual(results[0].error, None)
+        self.assertEqual(len(results[0].samples), 1)
+        self.assertEqual(router.busy, 0)
+        self.assertEqual(router.lte, '4')
+
+    def test_sweep_error_is_not_hidden(self):
+        from huawei_lte.bandsweep import BandSweep
+        class LostRouter(self.FakeRouter):
+            '''Loses the signal on B3, then rejects going back'''
+            @property
+            def signal(self):
+                if self.lte == '4':
+                    raise ValueError('Signal lost')
+                return super().signal
+            def set_lte_band(self, config):
+                if self.switches:
+                    return fakerouter.xml_error(100006)
+                return super().set_lte_band(config)
+        router = LostRouter()
+        sweep = BandSweep(router, [['B1', 'B3'], ['B3']], samples=1, min_samples=1, sample_interval=0, settle_time=0)
+        with self.assertRaises(ValueError) as raised:
+            sweep.run()
+        self.assertEqual(str(raised.exception), 'Signal lost')
+        self.assertEqual(router.lte, '4')
+
+    def test_network_sweep_response(self):
+        import xml.etree.ElementTree as ET
+        router = self.FakeRouter()
+        response = lte.Network(router).sweep_lte_bands({
+            'candidates': [['B32'], ['B1', 'B3'], ['B3']], 'samples': 1, 'sample_interval': 0, 'settle_time': 0})
+        root = ET.fromstring(response)
+        self.assertEqual([band.text for band in root.findall('Best/Band')], ['B3'])
+        results = root.findall('Results/Result')
+        self.assertEqual([[band.text for band in result.findall('Bands/Band')] for result in results],
+                         [['B3'], ['B1', 'B3'], ['B32']])
+        self.assertEqual([result.findtext('Samples') for result in results], ['1', '1', '1'])
+        self.assertEqual(results[0].findtext('Rsrp'), '-90.0')
+        self.assertEqual(results[0].findtext('Sinr'), '15.0')
+        self.assertEqual(results[0].findtext('Download'), '320.0')
+        self.assertEqual(results[2].findtext('Dominated'), '1')
+        self.assertEqual(results[0].findtext('Error'), '')
+        self.assertEqual(router.lte, '4')
 
 class Ethernet(unittest.TestCase):
     